@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+"""Summarize hits to reference sequences for each SV
+
+Produces the same reports as ``sqlite3 -header -csv hits.db <
+allhits.sql`` and ``allhits_byspecimen.sql`` given the csv files used
+to create hits.db (see hits_db.py), without creating a database. Input
+tables are joined using dicts keyed by SV or reference name in a
+single pass over the hits, and rows for each SV are written in order
+of SV name. Outputs are compressed if named with a .gz or .bz2 suffix.
+
+"""
+
+import argparse
+import csv
+import logging
+import re
+import sys
+from collections import defaultdict
+
+from fastalite import Opener
+
+from classifications import read_classifications, NAME, WANT_RANK, RANK, TAX_NAME
+from hits_db import null_values
+
+log = logging.getLogger(__name__)
+
+allhits_fields = [
+    'sv', 'rank', 'pct_id', 'classif_name', 'hit_desc', 'seqname', 'version',
+    'tax_id', 'length', 'ambig_count', 'is_type']
+
+allhits_byspecimen_fields = [
+    'sv', 'specimen_rep', 'abundance', 'specimen', 'rank', 'pct_id',
+    'classif_name', 'description_or_organism', 'seqname', 'version',
+    'tax_id', 'length', 'ambig_count', 'is_type']
+
+# columns of ref_info included in each report
+ref_fields = ['seqname', 'version', 'tax_id', 'length', 'ambig_count', 'is_type']
+
+# characters causing values to be quoted by the sqlite3 shell in csv mode
+needs_quote = re.compile(r'[\x00-\x20,"\'\x7f-\U0010ffff]')
+
+
+def null(val):
+    return None if val is None or val.lower() in null_values else val
+
+
+def as_number(val, convert):
+    """Return ``val`` as an int or float if possible (as for sqlite
+    columns with numeric affinity), otherwise unchanged.
+
+    """
+
+    try:
+        return convert(val)
+    except (TypeError, ValueError):
+        return val
+
+
+def sqlite_csv(val):
+    """Format a value as the sqlite3 shell does in csv mode"""
+    if val is None:
+        return ''
+    elif isinstance(val, float):
+        # equivalent to sqlite's "%!.15g"
+        text = '%.15g' % val
+        if 'e' in text and '.' not in text:
+            text = text.replace('e', '.0e')
+        elif not set(text) & set('.einf'):
+            text += '.0'
+        return text
+    elif isinstance(val, int):
+        return str(val)
+    elif needs_quote.search(val):
+        return '"{}"'.format(val.replace('"', '""'))
+    else:
+        return val
+
+
+def write_row(outfile, row):
+    outfile.write(','.join(sqlite_csv(val) for val in row) + '\n')
+
+
+def read_rows(fname, fieldnames=None):
+    """Yield dicts from csv file ``fname`` with null values replaced by
+    None. Column names are read from the file unless provided.
+
+    """
+
+    with open(fname, newline='') as f:
+        for row in csv.DictReader(f, fieldnames=fieldnames):
+            yield {k: null(v) for k, v in row.items()}
+
+
+def load_tables(classif, ref_info, seq_info, weights):
+    """Return dicts used to join each hit to its classification,
+    reference annotation, and specimens.
+
+    """
+
+    # species-level classification of each SV
+    species = defaultdict(list)
+    for row in read_classifications(classif):
+        if row[WANT_RANK] == 'species' and row[NAME] is not None:
+            species[row[NAME]].append((null(row[RANK]), null(row[TAX_NAME])))
+
+    refs = defaultdict(list)
+    for row in read_rows(ref_info):
+        if row['seqname'] is not None:
+            refs[row['seqname']].append(
+                [row.get('description') or row.get('organism')] +
+                [row[k] for k in ref_fields])
+
+    specimens = defaultdict(list)
+    for row in read_rows(seq_info, fieldnames=['name', 'specimen']):
+        specimens[row['name']].append(row['specimen'])
+
+    weights_by_name = defaultdict(list)
+    for row in read_rows(weights, fieldnames=['name', 'name1', 'abundance']):
+        weights_by_name[row['name']].append(
+            (row['name1'], as_number(row['abundance'], int)))
+
+    return species, refs, specimens, weights_by_name
+
+
+def group_hits(fname, species):
+    """Return a dict of {sv: [(pct_id, ref_info rows), ...]} for hits
+    to classified SVs, in the order of ``fname``.
+
+    """
+
+    hits = defaultdict(list)
+    for row in read_rows(fname):
+        if row['query'] in species:
+            hits[row['query']].append((as_number(row['pct_id'], float), row['target']))
+    return hits
+
+
+def allhits(species, refs, hits):
+    """Yield (sv, [joined rows]) for each SV with hits in order of SV
+    name; each row is a tuple (rank, pct_id, tax_name, desc,
+    *ref_fields).
+
+    """
+
+    for sv in sorted(hits):
+        rows = [(rank, pct_id, tax_name, *ref)
+                for rank, tax_name in species[sv]
+                for pct_id, target in hits[sv]
+                for ref in refs.get(target, [])]
+        if rows:
+            yield sv, rows
+
+
+def get_args(arguments):
+    parser = argparse.ArgumentParser(description=__doc__)
+    inputs = parser.add_argument_group('inputs')
+    inputs.add_argument('--hits', required=True,
+                        help='csv file with hits (output of blast2csv.py)')
+    inputs.add_argument('--ref-info', required=True,
+                        help='csv file with reference sequence annotation')
+    inputs.add_argument('--classif', required=True,
+                        help='classifications (csv or parquet)')
+    inputs.add_argument('--seq-info', required=True,
+                        help='headerless csv file mapping SV names to specimens')
+    inputs.add_argument('--weights', required=True,
+                        help='headerless csv file with columns name, name1, abundance')
+
+    outputs = parser.add_argument_group('outputs')
+    outputs.add_argument('--allhits', type=Opener('wt'), metavar='FILE',
+                         help='hits for each SV (as allhits.sql)')
+    outputs.add_argument('--allhits-byspecimen', type=Opener('wt'), metavar='FILE',
+                         help='hits for each SV and specimen (as allhits_byspecimen.sql)')
+
+    return parser.parse_args(arguments)
+
+
+def main(arguments):
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
+
+    args = get_args(arguments)
+
+    species, refs, specimens, weights = load_tables(
+        args.classif, args.ref_info, args.seq_info, args.weights)
+    hits = group_hits(args.hits, species)
+    log.info('hits for {} SVs'.format(len(hits)))
+
+    if args.allhits:
+        args.allhits.write(','.join(allhits_fields) + '\n')
+    if args.allhits_byspecimen:
+        args.allhits_byspecimen.write(','.join(allhits_byspecimen_fields) + '\n')
+
+    for sv, rows in allhits(species, refs, hits):
+        if args.allhits:
+            for row in rows:
+                write_row(args.allhits, (sv,) + row)
+
+        if args.allhits_byspecimen:
+            # order by abundance descending (nulls last); rows with
+            # equal abundance are ordered by hit, then specimen,
+            # which is the order produced by sqlite
+            by_specimen = [(name1, abundance, specimen) + row
+                           for row in rows
+                           for name1, abundance in weights.get(sv, [])
+                           for specimen in specimens.get(name1, [])]
+            by_specimen.sort(key=lambda r: r[1] if isinstance(r[1], int) else -1,
+                             reverse=True)
+            for row in by_specimen:
+                write_row(args.allhits_byspecimen, (sv,) + row)
+
+    for outfile in [args.allhits, args.allhits_byspecimen]:
+        if outfile:
+            outfile.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
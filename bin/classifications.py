@@ -0,0 +1,96 @@
+"""Read and write tables of classifications created by get_classifications.py
+
+Tables may be either csv or parquet files (identified by a '.parquet'
+suffix); parquet files have typed columns, with columns containing
+rank and taxonomic names dictionary-encoded. Reading and writing
+parquet files requires pyarrow.
+
+"""
+
+import csv
+
+# rows are handled as tuples with values in this order
+fieldnames = ['name', 'want_rank', 'rank', 'rank_order',
+              'tax_id', 'tax_name', 'likelihood']
+NAME, WANT_RANK, RANK, RANK_ORDER, TAX_ID, TAX_NAME, LIKELIHOOD = range(len(fieldnames))
+
+
+def is_parquet(fname):
+    return str(fname).endswith('.parquet')
+
+
+def get_schema():
+    import pyarrow as pa
+
+    category = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ('name', pa.string()),
+        ('want_rank', category),
+        ('rank', category),
+        ('rank_order', pa.int32()),
+        ('tax_id', pa.string()),
+        ('tax_name', category),
+        ('likelihood', pa.float64()),
+    ])
+
+
+class ParquetWriter(object):
+    """Write rows of classifications to a parquet file, with an
+    interface similar to csv.writer. Rows are buffered and written as
+    a row group every ``batch_size`` rows.
+
+    """
+
+    def __init__(self, fname, batch_size=100000):
+        import pyarrow.parquet as pq
+
+        self.schema = get_schema()
+        self.writer = pq.ParquetWriter(fname, self.schema)
+        self.batch_size = batch_size
+        self.rows = []
+
+    def writerow(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        import pyarrow as pa
+
+        if self.rows:
+            columns = [pa.array(col, type=field.type)
+                       for col, field in zip(zip(*self.rows), self.schema)]
+            self.writer.write_table(pa.Table.from_arrays(columns, schema=self.schema))
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def read_classifications(fname):
+    """Yield a tuple with elements corresponding to ``fieldnames`` for
+    each row in csv or parquet file ``fname``. rank_order is an int
+    and likelihood is a float (either may be None for unclassified
+    sequences).
+
+    """
+
+    if is_parquet(fname):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(fname).iter_batches(columns=fieldnames):
+            yield from zip(*(col.to_pylist() for col in batch.columns))
+    else:
+        with open(fname) as f:
+            reader = csv.reader(f)
+            next(reader)  # header
+            for row in reader:
+                row[RANK_ORDER] = int(row[RANK_ORDER]) if row[RANK_ORDER] else None
+                row[LIKELIHOOD] = float(row[LIKELIHOOD]) if row[LIKELIHOOD] else None
+                yield tuple(row)
+
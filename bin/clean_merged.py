@@ -1,14 +1,97 @@
 #!/usr/bin/env python3
 
-"""Clean up output of esl-alimerge
+"""Clean up and optionally filter output of esl-alimerge
+
+Reads the merged alignment once (use "-" to read from stdin) and
+writes the cleaned alignment, in which insert gaps ('.') are replaced
+with '-' and residues are upper case. Given cmalign scores, also
+writes the alignment and unaligned query sequences, excluding queries
+with bit scores below --min-bit-score (see also filter_merged.py).
 
 """
 
 from __future__ import print_function
 import sys
 import argparse
+import string
+
+from fastalite import Opener
+
+from seqstore import Seq, SeqStoreWriter
+
+LOWER = string.ascii_lowercase.encode()
+UPPER = string.ascii_uppercase.encode()
+
+# translation tables for bytes.translate
+ALIGNED = bytes.maketrans(b'.' + LOWER, b'-' + UPPER)
+UNALIGNED = bytes.maketrans(LOWER, UPPER)
+NOT_LETTERS = bytes(sorted(set(range(256)) - set(LOWER + UPPER)))
+
+
+def read_scores(fobj, min_bit_score=0):
+    headers = """idx seq_name length cm_from cm_to trunc bit_sc avg_pp
+    band_calc alignment total mem""".split()
+
+    seq_name_ix = headers.index('seq_name')
+    bit_sc_ix = headers.index('bit_sc')
+
+    for line in fobj:
+        if line.startswith('#') or not line.strip():
+            continue
+        vals = line.split()
+        yield (vals[seq_name_ix], float(vals[bit_sc_ix]))
+
+
+def read_fasta(fobj):
+    """Yield tuples (id, seq) as bytes from a binary fasta file"""
+    seqid, lines = None, []
+    for line in fobj:
+        if line.startswith(b'>'):
+            if seqid is not None:
+                yield seqid, b''.join(lines)
+            seqid, lines = line[1:].split(None, 1)[0], []
+        else:
+            lines.append(line.rstrip())
+    if seqid is not None:
+        yield seqid, b''.join(lines)
+
+
+def clean_merged(infile, cleaned=None, q_scores=None, min_bit_score=0,
+                 filtered_aln=None, filtered=None, store=None):
+    """Write outputs from the merged alignment in binary file ``infile``.
+    ``q_scores`` is a dict of {name: bit score} for query sequences
+    (names as bytes); if None, no sequences are filtered. ``cleaned``,
+    ``filtered_aln`` and ``filtered`` are binary files; ``store`` is
+    a SeqStoreWriter for the cleaned (or if filtering, filtered)
+    alignment.
+
+    """
 
-from fastalite import fastalite, Opener
+    q_scores = q_scores or {}
+    for seqid, seq in read_fasta(infile):
+        aligned = seq.translate(ALIGNED)
+        record = b'>' + seqid + b'\n' + aligned + b'\n'
+        if cleaned:
+            cleaned.write(record)
+
+        # filter only query seqs
+        if seqid in q_scores:
+            if q_scores[seqid] < min_bit_score:
+                print('removing {} bit score {}'.format(seqid.decode(), q_scores[seqid]))
+                continue
+            if filtered:
+                filtered.write(b'>' + seqid + b'\n' +
+                               seq.translate(UNALIGNED, NOT_LETTERS) + b'\n')
+
+        if filtered_aln:
+            filtered_aln.write(record)
+        if store:
+            name = seqid.decode()
+            store.write(Seq(name, name, aligned))
+
+
+def binary(fobj):
+    return getattr(fobj, 'buffer', fobj)
 
 
 def main(arguments):
@@ -18,19 +101,51 @@ def main(arguments):
         formatter_class=argparse.RawDescriptionHelpFormatter)
 
     inputs = parser.add_argument_group('input files')
-    inputs.add_argument('merged', type=Opener('r'))
+    inputs.add_argument('merged', type=Opener('rb'),
+                        help='output of esl-alimerge in afa format ("-" for stdin)')
+    inputs.add_argument('--scores', type=Opener('r'),
+                        help='cmalign scores for query sequences (enables filtering)')
 
     outputs = parser.add_argument_group('output files')
     outputs.add_argument(
-        'cleaned', type=Opener('w'),
-        help='filtered sequence alignment, including refs')
+        'cleaned', type=Opener('wb'),
+        help='cleaned sequence alignment, including refs')
+    outputs.add_argument(
+        '--filtered-aln', type=Opener('wb'),
+        help='filtered sequence alignment, including refs (requires --scores)')
+    outputs.add_argument(
+        '--filtered', type=Opener('wb'),
+        help='filtered, unaligned query seqs without refs (requires --scores)')
+    outputs.add_argument(
+        '--seqstore', metavar='FILE',
+        help=('also write the alignment (filtered if --scores is provided) '
+              'to a sequence store (see seqstore.py)'))
+
+    parser.add_argument('--min-bit-score', default=0, type=float)
 
     args = parser.parse_args(arguments)
 
-    seqs = fastalite(args.merged)
-    for seq in seqs:
-        args.cleaned.write('>{}\n{}\n'.format(
-            seq.id, seq.seq.replace('.', '-').upper()))
+    if (args.filtered_aln or args.filtered) and not args.scores:
+        parser.error('--scores is required for filtered outputs')
+
+    q_scores = None
+    if args.scores:
+        q_scores = {name.encode(): score for name, score in read_scores(args.scores)}
+
+    store = SeqStoreWriter(args.seqstore) if args.seqstore else None
+
+    clean_merged(binary(args.merged), cleaned=binary(args.cleaned),
+                 q_scores=q_scores, min_bit_score=args.min_bit_score,
+                 filtered_aln=args.filtered_aln and binary(args.filtered_aln),
+                 filtered=args.filtered and binary(args.filtered),
+                 store=store)
+
+    for fobj in [args.cleaned, args.filtered_aln, args.filtered]:
+        if fobj and fobj is not sys.stdout:
+            fobj.close()
+
+    if store:
+        store.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+"""Align sequences to a covariance model in chunks using cmalign
+
+Input sequences are divided into --chunks contiguous chunks in
+--workdir, and each is aligned by a separate cmalign process (--jobs
+at a time; with --srun, each is submitted as a slurm job step). A
+chunk is recorded in a checkpoint manifest (``manifest.csv`` in
+--workdir) when its alignment is complete, and chunks recorded with
+the same inputs and options are not aligned again, so a failed run
+can be resumed. Alignments are merged in chunk order using
+esl-alimerge, and score tables are concatenated with renumbered
+indices.
+
+--cmalign and --esl-alimerge may include a command prefix, for
+example, "singularity exec image.sif cmalign".
+
+"""
+
+import argparse
+import csv
+import hashlib
+import logging
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+from multiprocessing.pool import ThreadPool
+
+from shards import write_shards
+
+log = logging.getLogger(__name__)
+
+MANIFEST = 'manifest.csv'
+MANIFEST_FIELDS = ['chunk', 'digest']
+
+
+def file_digest(fname, digest=None):
+    digest = digest or hashlib.md5()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(2 ** 20), b''):
+            digest.update(block)
+    return digest
+
+
+def read_manifest(fname):
+    """Return a dict of {chunk: digest} for completed chunks"""
+    if not os.path.exists(fname):
+        return {}
+    with open(fname, newline='') as f:
+        return {row['chunk']: row['digest'] for row in csv.DictReader(f)}
+
+
+def align(cmd, cmfile, chunk):
+    """Run cmalign for a single chunk; outputs are written to temporary
+    files and renamed on success. Returns (chunk, error), where error
+    is None on success.
+
+    """
+
+    base = os.path.splitext(chunk)[0]
+    sto, sfile = base + '.sto', base + '.scores'
+    # options must precede positional arguments
+    cmd = cmd + ['-o', sto + '.tmp', '--sfile', sfile + '.tmp', cmfile, chunk]
+    log.info(' '.join(cmd))
+    try:
+        with open(base + '.log', 'w') as logfile:
+            subprocess.check_call(cmd, stdout=logfile)
+    except subprocess.CalledProcessError as err:
+        return chunk, err
+    os.rename(sto + '.tmp', sto)
+    os.rename(sfile + '.tmp', sfile)
+    return chunk, None
+
+
+def merge_scores(fnames, outfile):
+    """Concatenate cmalign score tables, retaining the header of the
+    first and renumbering the index in the first column.
+
+    """
+
+    idx = 0
+    for i, fname in enumerate(fnames):
+        with open(fname) as f:
+            for line in f:
+                if line.startswith('#'):
+                    if i == 0:
+                        outfile.write(line)
+                elif line.strip():
+                    idx += 1
+                    match = re.match(r'\s*\d+', line)
+                    outfile.write(
+                        str(idx).rjust(match.end()) + line[match.end():])
+
+
+def get_args(arguments):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('cmfile', help='covariance model')
+    parser.add_argument('seqs', help='input fasta file')
+    parser.add_argument('-o', '--outfile', required=True,
+                        help='merged alignment (stockholm format)')
+    parser.add_argument('--sfile', required=True,
+                        help='merged table of scores')
+    parser.add_argument('--workdir', required=True,
+                        help='directory for chunks and the checkpoint manifest')
+    parser.add_argument('--chunks', type=int, default=4,
+                        help='number of chunks [%(default)s]')
+    parser.add_argument('--jobs', type=int,
+                        help='chunks to align concurrently [default: --chunks]')
+    parser.add_argument('--cpu', type=int, default=1,
+                        help='CPUs used by cmalign for each chunk [%(default)s]')
+    parser.add_argument('--mxsize', default='8196',
+                        help='value for cmalign --mxsize [%(default)s]')
+    parser.add_argument('--srun', action='store_true', default=False,
+                        help='align each chunk using srun')
+    parser.add_argument('--cmalign', default='cmalign',
+                        help='cmalign command [%(default)s]')
+    parser.add_argument('--esl-alimerge', default='esl-alimerge',
+                        help='esl-alimerge command [%(default)s]')
+    return parser.parse_args(arguments)
+
+
+def main(arguments):
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
+
+    args = get_args(arguments)
+
+    options = ['--mxsize', args.mxsize, '--noprob', '--dnaout']
+    cmd = shlex.split(args.cmalign) + ['--cpu', str(args.cpu)] + options
+    if args.srun:
+        cmd = ['srun', '--ntasks', '1', '--cpus-per-task', str(args.cpu)] + cmd
+
+    os.makedirs(args.workdir, exist_ok=True)
+    chunks = write_shards(args.seqs, args.chunks, args.workdir)
+
+    # a chunk is identified by its sequences, the model, and options
+    # affecting the alignment
+    base_digest = file_digest(args.cmfile)
+    base_digest.update(' '.join(options).encode())
+    digests = {os.path.basename(chunk): file_digest(chunk, base_digest.copy()).hexdigest()
+               for chunk in chunks}
+
+    manifest_file = os.path.join(args.workdir, MANIFEST)
+    done = {chunk: digest for chunk, digest in read_manifest(manifest_file).items()
+            if digests.get(chunk) == digest and
+            os.path.exists(os.path.join(args.workdir, os.path.splitext(chunk)[0] + '.sto'))}
+    todo = [chunk for chunk in chunks if os.path.basename(chunk) not in done]
+    log.info('{} of {} chunks already aligned'.format(len(chunks) - len(todo), len(chunks)))
+
+    with open(manifest_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=MANIFEST_FIELDS)
+        writer.writeheader()
+        writer.writerows(dict(chunk=chunk, digest=digest) for chunk, digest in done.items())
+        f.flush()
+
+        # record each chunk as soon as it is complete
+        failed = []
+        with ThreadPool(args.jobs or args.chunks) as pool:
+            for chunk, err in pool.imap_unordered(lambda c: align(cmd, args.cmfile, c), todo):
+                if err:
+                    log.error('{} failed: {}'.format(chunk, err))
+                    failed.append(chunk)
+                    continue
+                name = os.path.basename(chunk)
+                writer.writerow(dict(chunk=name, digest=digests[name]))
+                f.flush()
+
+    if failed:
+        sys.exit('{} of {} chunks failed; run again to resume'.format(
+            len(failed), len(chunks)))
+
+    stos = [os.path.splitext(chunk)[0] + '.sto' for chunk in chunks]
+    if len(stos) == 1:
+        shutil.copyfile(stos[0], args.outfile)
+    else:
+        subprocess.check_call(
+            shlex.split(args.esl_alimerge) + ['--dna', '-o', args.outfile] + stos)
+
+    with open(args.sfile, 'w') as f:
+        merge_scores([os.path.splitext(chunk)[0] + '.scores' for chunk in chunks], f)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -6,16 +6,145 @@ The alignment profile must be calibrated using cmcalibrate. See
 documentation for cmsearch for details:
 http://eddylab.org/infernal/Userguide.pdf
 
+Input sequences are divided into --shards contiguous chunks, each
+searched by a separate cmsearch process (sharing --cpu CPUs) writing
+its table of hits to a named pipe. Chunks are partitioned in order as
+each search completes, so outputs are in the order of the input.
+E-values depend on the size of the database searched, so each search
+is given the size of the whole input (cmsearch -Z; unless provided
+using --dbsize), and results do not depend on the number of shards.
+
+With --hit-cache, hits for each sequence are saved in a sqlite database
+(see hitcache.py) keyed by the sequence, the checksum of cmfile, and
+search options including -Z, and only sequences not found in the cache
+are searched; sequences are partitioned once all searches are
+complete. Because saved E-values depend on -Z, hits are reused only by
+runs with the same database size, so a fixed --dbsize should be
+provided when sharing a cache among runs with different inputs.
+
 """
 
 from __future__ import print_function
 import sys
 import argparse
+import errno
+import os
 import tempfile
 import subprocess
-import shutil
+import threading
+
+from fastalite import Opener, fastalite
+
+from hitcache import HitCache, md5sum, seq_hash
+from shards import write_shards
+
+NAME, E_VAL = 0, 15
+
+# key in the hit cache for the comments (header and trailer) of the
+# table of hits, so that --scores is complete when no sequences are
+# searched
+TEMPLATE = 'tblout'
+
+
+def dbsize(fname):
+    """Return the size of the database in ``fname`` in megabases, as
+    calculated by cmsearch when searching both strands (option -Z)
+
+    """
+
+    with Opener()(fname) as f:
+        return sum(len(seq.seq) for seq in fastalite(f)) * 2 / 1e6
+
+
+class Search(object):
+    """Run cmsearch on ``seqs``, reading the table of hits from a named
+    pipe in a separate thread.
+
+    """
+
+    def __init__(self, cmd, cmfile, seqs, tblout):
+        self.seqs = seqs
+        self.tblout = tblout
+        self.lines = []
+        os.mkfifo(tblout)
+        self.reader = threading.Thread(target=self.read_table, daemon=True)
+        self.reader.start()
+
+        # options must precede positional arguments
+        cmd = cmd + ['--tblout', tblout, cmfile, seqs]
+        sys.stderr.write(' '.join(cmd) + '\n')
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+
+    def read_table(self):
+        with open(self.tblout) as f:
+            self.lines = f.readlines()
+
+    def release_reader(self):
+        """Unblock the reader if cmsearch exited without opening the
+        pipe, and wait for it to finish
+
+        """
+
+        while self.reader.is_alive():
+            try:
+                # fails with ENXIO until the reader opens the pipe
+                os.close(os.open(self.tblout, os.O_WRONLY | os.O_NONBLOCK))
+            except OSError as err:
+                if err.errno != errno.ENXIO:
+                    raise
+            self.reader.join(0.1)
 
-from fastalite import fastalite
+    def wait(self):
+        """Wait for the search to complete and return lines of the table"""
+        returncode = self.proc.wait()
+        if returncode != 0:
+            self.release_reader()
+            raise subprocess.CalledProcessError(returncode, self.proc.args)
+
+        self.reader.join()
+        return self.lines
+
+
+def hit_lines(lines):
+    return [line for line in lines if line.strip() and not line.startswith('#')]
+
+
+def keep_names(lines, min_evalue):
+    """Return names of sequences with hits in ``lines`` with E-values
+    no greater than ``min_evalue``
+
+    """
+
+    rows = [line.split() for line in hit_lines(lines)]
+    return {row[NAME] for row in rows if float(row[E_VAL]) <= min_evalue}
+
+
+def partition(seqs, keep, outfile, discarded=None):
+    for seq in seqs:
+        if seq.id in keep:
+            outfile.write('>{}\n{}\n'.format(seq.id, seq.seq))
+        elif discarded:
+            discarded.write('>{}\n{}\n'.format(seq.id, seq.seq))
+
+
+def write_scores(tables, outfile, hits=None):
+    """Write hits from each table (or ``hits`` if provided) preceded by
+    the header and followed by the trailing comments (program and
+    options) of the first table.
+
+    """
+
+    first = tables[0] if tables else []
+    # the trailing comments start with a line containing only "#"
+    n = next((i for i, line in enumerate(first)
+              if not line.startswith('#') or line.strip() == '#'), len(first))
+    outfile.writelines(first[:n])
+    if hits is None:
+        for lines in tables:
+            outfile.writelines(hit_lines(lines))
+    else:
+        outfile.writelines(hits)
+    outfile.writelines(line for line in first[n:] if line.startswith('#'))
 
 
 def main(arguments):
@@ -23,8 +152,7 @@ def main(arguments):
     parser = argparse.ArgumentParser(
         description=__doc__,
         formatter_class=argparse.RawDescriptionHelpFormatter)
-    parser.add_argument('seqs', type=argparse.FileType('r'),
-                        help="Input fasta file")
+    parser.add_argument('seqs', help="Input fasta file")
     parser.add_argument('cmfile', help="Calibrated cmfile")
     parser.add_argument('-o', '--outfile', default=sys.stdout, metavar='FILE',
                         type=argparse.FileType('w'),
@@ -40,34 +168,87 @@ def main(arguments):
                         help='path to cmsearch executable [%(default)s]')
     parser.add_argument('--cpu', type=int, default=10, metavar='N',
                         help='number of CPUs [%(default)s]')
+    parser.add_argument('--shards', type=int, default=1, metavar='N',
+                        help=('number of concurrent cmsearch processes, '
+                              'each using cpu/N CPUs [%(default)s]'))
+    parser.add_argument('--dbsize', type=float, metavar='MB',
+                        help=('database size in Mb for calculating E-values '
+                              '(cmsearch -Z) [calculated from seqs]'))
+    parser.add_argument('--hit-cache', metavar='FILE',
+                        help='sqlite database of hits for previously searched sequences')
 
     args = parser.parse_args(arguments)
 
-    # run cmsearch
-    NAME, E_VAL = 0, 15
+    nshards = max(1, min(args.shards, args.cpu))
+    z = args.dbsize if args.dbsize is not None else dbsize(args.seqs)
+    options = ['--noali', '--hmmonly', '-Z', str(z)]
+    cmd = [args.cmsearch] + options + ['--cpu', str(max(1, args.cpu // nshards))]
 
-    with tempfile.NamedTemporaryFile('w+t', dir='.') as tf:
-        cmd = [args.cmsearch,
-               '--noali',
-               '--hmmonly',
-               '--tblout', tf.name,
-               '--cpu', str(args.cpu),
-               args.cmfile, args.seqs.name]
-        sys.stderr.write(' '.join(cmd) + '\n')
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-        p.communicate()
-        lines = [line.split() for line in tf.readlines()
-                 if line.strip() and not line.startswith('#')]
-        keep = {line[NAME] for line in lines if float(line[E_VAL]) <= args.min_evalue}
+    include, template = None, None
+    if args.hit_cache:
+        # E-values in saved hits are valid only for the same -Z
+        cache = HitCache(args.hit_cache, 'cmsearch', md5sum(args.cmfile), ' '.join(options))
+        with Opener()(args.seqs) as f:
+            hashes = [(seq.id, seq_hash(seq.seq)) for seq in fastalite(f)]
+        cached = cache.get({seqhash for __, seqhash in hashes})
+        include = {name for name, seqhash in hashes if seqhash not in cached}
+        sys.stderr.write('{} of {} sequences found in {}\n'.format(
+            len(hashes) - len(include), len(hashes), args.hit_cache))
+        template = cache.get([TEMPLATE]).get(TEMPLATE)
+        if not include and template is None and hashes:
+            # search one sequence to obtain the comments of the table
+            include = {hashes[0][0]}
 
-        if args.scores:
-            shutil.copyfile(tf.name, args.scores)
+    with tempfile.TemporaryDirectory(dir='.') as tmpdir:
+        shards = write_shards(args.seqs, nshards, tmpdir, include) if include != set() else []
+        searches = [Search(cmd, args.cmfile, seqs,
+                           os.path.join(tmpdir, 'tblout{}'.format(i)))
+                    for i, seqs in enumerate(shards)]
 
-    for seq in fastalite(args.seqs):
-        if seq.id in keep:
-            args.outfile.write('>{}\n{}\n'.format(seq.id, seq.seq))
-        elif args.discarded:
-            args.discarded.write('>{}\n{}\n'.format(seq.id, seq.seq))
+        # partition each shard as soon as its search is complete
+        tables = []
+        for search in searches:
+            try:
+                lines = search.wait()
+            except subprocess.CalledProcessError:
+                for other in searches:
+                    other.proc.kill()
+                raise
+            tables.append(lines)
+            if not args.hit_cache:
+                with open(search.seqs) as f:
+                    partition(fastalite(f), keep_names(lines, args.min_evalue),
+                              args.outfile, args.discarded)
+
+    hits = None
+    if args.hit_cache:
+        # hits are cached without the sequence name; identical
+        # sequences with different names are saved once
+        names = dict(hashes)
+        first = {}
+        for name, seqhash in hashes:
+            first.setdefault(seqhash, name)
+        new_hits = {seqhash: [] for name, seqhash in hashes if name in include}
+        for line in hit_lines(line for lines in tables for line in lines):
+            name, rest = line.rstrip('\n').split(None, 1)
+            if first[names[name]] == name:
+                new_hits[names[name]].append(rest)
+        if tables:
+            template = [line for line in tables[0] if line.startswith('#')]
+            new_hits[TEMPLATE] = template
+        cache.put(new_hits)
+        cache.close()
+        cached.update(new_hits)
+
+        hits = ['{} {}\n'.format(name, rest) for name, seqhash in hashes
+                for rest in cached[seqhash]]
+        with Opener()(args.seqs) as f:
+            partition(fastalite(f), keep_names(hits, args.min_evalue),
+                      args.outfile, args.discarded)
+
+    if args.scores:
+        with open(args.scores, 'w') as f:
+            write_scores(tables or ([template] if template else []), f, hits)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,46 @@
+"""Names of per-taxon output directories written by get_details.py
+
+Has no dependencies outside of the standard library so that it can be
+imported by SConstruct-get-details.
+
+"""
+
+import csv
+import os
+import re
+
+# identifies the inputs used to create the contents of each output
+# directory; see get_details.make_outputs()
+DIGEST_FILE = '.digest'
+
+
+def safename(text):
+    return '_'.join([e for e in re.split(r'[^a-zA-Z0-9]+', text) if e])
+
+
+def taxon_dir(outdir, rank, tax_name):
+    return os.path.join(outdir, rank, safename(tax_name))
+
+
+def taxon_files(outdir, rank, tax_name):
+    """Return paths of the files created for a taxon as a dict"""
+    dirname = taxon_dir(outdir, rank, tax_name)
+    return {key: os.path.join(dirname, fname) for key, fname in [
+        ('hits', 'hits.csv'),
+        ('sv_names', 'sv_names.csv'),
+        ('aln', 'aln.fasta'),
+        ('digest', DIGEST_FILE),
+    ]}
+
+
+def list_taxa(sv_table_long):
+    """Return a sorted list of (rank, tax_name, tax_id) for each
+    taxon in ``sv_table_long``, each of which has an output directory
+    once get_details.py has run. Used to define targets in
+    SConstruct-get-details.
+
+    """
+
+    with open(sv_table_long) as f:
+        return sorted({(row['rank'], row['tax_name'], row['tax_id'])
+                       for row in csv.DictReader(f)})
@@ -11,6 +11,11 @@ from tempfile import NamedTemporaryFile
 import csv
 import subprocess
 
+from fastalite import Opener
+
+from jplace import JSONStream, write_placefile
+from split_jplace import split_placements
+
 
 def ntf(*args, **kwargs):
     tmpdir = kwargs.get('dir')
@@ -46,13 +51,12 @@ def main(arguments):
     except ValueError:
         sys.exit('Warning: no query sequences were specified!')
 
-    # filter jplace
-    cmd = [args.guppy, 'filter', args.jplace, '-Vr', '-o', args.placements]
-    for name in names:
-        # escape pipes in regular expression
-        cmd.extend(['-Ir', name.replace('|', r'\|')])
-
-    subprocess.check_call(cmd)
+    # filter jplace (see split_jplace.py to filter for many sets of names)
+    with Opener()(args.jplace) as infile:
+        members, (placements,) = split_placements(
+            JSONStream(infile).items(), [set(names)])
+    with open(args.placements, 'w') as outfile:
+        write_placefile(members, placements, outfile)
 
     # tog tree
     if args.tog:
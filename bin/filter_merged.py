@@ -2,28 +2,19 @@
 
 """Reformat and filter output of esl-alimerge
 
+Equivalent to clean_merged.py with --scores, without writing the
+cleaned alignment.
+
 """
 
 from __future__ import print_function
 import sys
 import argparse
-import re
-
-from fastalite import fastalite, Opener
-
-
-def read_scores(fobj, min_bit_score=0):
-    headers = """idx seq_name length cm_from cm_to trunc bit_sc avg_pp
-    band_calc alignment total mem""".split()
 
-    seq_name_ix = headers.index('seq_name')
-    bit_sc_ix = headers.index('bit_sc')
+from fastalite import Opener
 
-    for line in fobj:
-        if line.startswith('#') or not line.strip():
-            continue
-        vals = line.split()
-        yield (vals[seq_name_ix], float(vals[bit_sc_ix]))
+from clean_merged import binary, clean_merged, read_scores
+from seqstore import SeqStoreWriter
 
 
 def main(arguments):
@@ -33,34 +24,39 @@ def main(arguments):
         formatter_class=argparse.RawDescriptionHelpFormatter)
 
     inputs = parser.add_argument_group('input files')
-    inputs.add_argument('merged', type=Opener('r'))
+    inputs.add_argument('merged', type=Opener('rb'))
     inputs.add_argument('scores', type=Opener('r'))
 
     outputs = parser.add_argument_group('output files')
     outputs.add_argument(
-        '--filtered-aln', type=Opener('w'),
+        '--filtered-aln', type=Opener('wb'),
         help='filtered sequence alignment, including refs')
     outputs.add_argument(
-        '--filtered', type=Opener('w'),
+        '--filtered', type=Opener('wb'),
         help='filtered, unaligned query seqs without refs')
+    outputs.add_argument(
+        '--seqstore', metavar='FILE',
+        help='also write the filtered alignment to a sequence store (see seqstore.py)')
 
     parser.add_argument('--min-bit-score', default=0, type=float)
 
     args = parser.parse_args(arguments)
 
-    q_scores = dict(read_scores(args.scores))
-    seqs = fastalite(args.merged)
-    for seq in seqs:
-        # filter only query seqs
-        if seq.id in q_scores:
-            if q_scores[seq.id] < args.min_bit_score:
-                print('removing {} bit score {}'.format(seq.id, q_scores[seq.id]))
-                continue
-            args.filtered.write('>{}\n{}\n'.format(
-                seq.id, re.sub(r'[^A-Z]', '', seq.seq.upper())))
-
-        args.filtered_aln.write('>{}\n{}\n'.format(
-            seq.id, seq.seq.replace('.', '-').upper()))
+    q_scores = {name.encode(): score for name, score in read_scores(args.scores)}
+    store = SeqStoreWriter(args.seqstore) if args.seqstore else None
+
+    clean_merged(binary(args.merged), q_scores=q_scores,
+                 min_bit_score=args.min_bit_score,
+                 filtered_aln=args.filtered_aln and binary(args.filtered_aln),
+                 filtered=args.filtered and binary(args.filtered),
+                 store=store)
+
+    for fobj in [args.filtered_aln, args.filtered]:
+        if fobj and fobj is not sys.stdout:
+            fobj.close()
+
+    if store:
+        store.close()
 
 
 if __name__ == '__main__':
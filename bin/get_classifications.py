@@ -10,25 +10,59 @@ import sys
 import argparse
 import sqlite3
 import csv
+import hashlib
+import json
+import os
+from collections import deque
 from itertools import groupby
 from operator import itemgetter, xor
 from functools import reduce
 import logging
 import pprint
+import time
+from multiprocessing import Pool
 
 import sqlalchemy
 from taxtastic.taxonomy import Taxonomy
 from taxtastic.subcommands.taxtable import as_taxtable_rows
 
+from classifications import fieldnames, NAME, WANT_RANK, RANK, TAX_NAME, ParquetWriter
+
 logging.basicConfig(level=logging.WARNING, format='%(levelname)s %(funcName)s %(lineno)d %(message)s')
 log = logging.getLogger(__name__)
 
 
-def dict_factory(cursor, row):
-    d = {}
-    for idx, col in enumerate(cursor.description):
-        d[col[0]] = row[idx]
-    return d
+# Rows are grouped (and returned) in the order of the multiclass
+# index created by prepare_db() so that no sort of the full result is
+# required; rows for each SV are put in rank order as they are fetched.
+classif_cmd = """
+select name,
+       m.want_rank,
+       m.rank,
+       r.rank_order,
+       group_concat(distinct m.tax_id) as tax_id,
+       group_concat(t.tax_name, '^') as _tax_name,
+       sum(m.likelihood) as likelihood
+from multiclass m
+join placement_names using(placement_id, name)
+left join taxa t using(tax_id)
+left join ranks r on m.rank = r.rank
+join ranks wr on m.want_rank = wr.rank
+where (m.rank = m.want_rank
+       or m.want_rank in ('phylum', 'class', 'order', 'family', 'genus', 'species'))
+and wr.rank_order <= :min_rank_order
+group by name, placement_id, m.want_rank
+order by name, placement_id, m.want_rank
+"""
+
+# indexes supporting classif_cmd; multiclass_classif is deliberately
+# not a covering index so that rows within each group are visited in
+# rowid order, which determines the order of tax_ids and tax_names in
+# the output.
+placedb_indexes = [
+    """create index if not exists multiclass_classif
+    on multiclass (name, placement_id, want_rank)""",
+]
 
 
 def concat_name(taxnames, rank, sep='/'):
@@ -110,129 +144,168 @@ def test_combine_lineages():
     assert combined['tax_name'] == 'Anaerococcus prevotii/tetradius'
 
 
-def main(arguments):
+def fetch_rows(cur, batch_size=10000):
+    """Iterate over rows of cursor ``cur``, fetching ``batch_size``
+    rows at a time.
 
-    parser = argparse.ArgumentParser(
-        description=__doc__,
-        formatter_class=argparse.RawDescriptionHelpFormatter)
+    """
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        yield from rows
 
-    inputs = parser.add_argument_group('input files')
-    inputs.add_argument(
-        'placedb', help="output of 'guppy classify' (sqlite3)")
 
-    inputs.add_argument(
-        '--to-rename', type=argparse.FileType(),
-        help="""csv file with headers 'tax_name', 'rank', 'sv',
-        'new_tax_name', 'new_rank'""")
-    inputs.add_argument(
-        '--taxdb', help="taxonomy database (sqlite3)")
+def prepare_db(conn, min_rank_order):
+    """Add indexes supporting classif_cmd to placedb connection
+    ``conn``, update statistics used by the query planner, and log
+    the resulting query plan.
 
-    outputs = parser.add_argument_group('output files')
-    outputs.add_argument(
-        '-c', '--classifications', default=sys.stdout, type=argparse.FileType('w'),
-        help="csv file describing classification of each input (default stdout)")
+    """
 
-    parser.add_argument('--test', action='store_true', default=False,
-                        help='run tests and exit')
+    for cmd in placedb_indexes:
+        log.info(' '.join(cmd.split()))
+        conn.execute(cmd)
 
-    args = parser.parse_args(arguments)
+    log.info('analyze')
+    conn.execute('analyze')
+    conn.commit()
 
-    if args.test:
-        test_combine_lineages()
-        test_unconcat_names()
-        sys.exit()
+    log.info('query plan:')
+    plan = conn.execute('explain query plan ' + classif_cmd,
+                        {'min_rank_order': min_rank_order})
+    for row in plan:
+        log.info(row[-1])
 
-    cmd = """
-    select placement_id,
-           name,
-           m.want_rank,
-           group_concat(distinct m.tax_id) as tax_id,
-           m.rank,
-           sum(m.likelihood) as likelihood,
-           group_concat(t.tax_name, '^') as _tax_name,
-           r.rank_order
-    from placement_names
-    left join multiclass m using(placement_id, name)
-    left join taxa t using(tax_id)
-    left join ranks r on m.rank = r.rank
-    left join ranks wr on m.want_rank = wr.rank
-    where want_rank is not NULL
-    and (m.rank = want_rank
-         or want_rank in ('phylum', 'class', 'order', 'family', 'genus', 'species'))
-    and wr.rank_order <= :min_rank_order
-    group by placement_id, name, want_rank
-    order by name, wr.rank_order, tax_name
-    """
 
-    fieldnames = ['name', 'want_rank', 'rank', 'rank_order',
-                  'tax_id', 'tax_name', 'likelihood']
-    writer = csv.DictWriter(args.classifications, fieldnames, extrasaction='ignore')
-    writer.writeheader()
+def get_classifications(conn, all_ranks, min_rank_order, batch_size=10000):
+    """Yield a tuple with elements corresponding to ``fieldnames`` for
+    each classification in placedb connection ``conn``. Rows are
+    ordered by name and then by rank, so all rows for a given SV are
+    contiguous.
 
-    min_rank = 'species'
-    rows = []
-    with sqlite3.connect(args.placedb) as conn:
-        conn.row_factory = dict_factory
-        cur = conn.cursor()
+    """
 
-        cur.execute('select rank, rank_order from ranks')
-        all_ranks = {r['rank']: r['rank_order'] for r in cur.fetchall()}
-        min_rank_order = all_ranks[min_rank]
+    cur = conn.cursor()
+    cur.execute(classif_cmd, {'min_rank_order': min_rank_order})
+    for name, grp in groupby(fetch_rows(cur, batch_size), itemgetter(NAME)):
+        grp = sorted(grp, key=lambda row: all_ranks[row[WANT_RANK]])
+        for __, want_rank, rank, rank_order, tax_id, tax_names, likelihood in grp:
+            yield (name, want_rank, rank, rank_order, tax_id,
+                   concat_name(tax_names.split('^'), rank), likelihood)
 
-        cur.execute(cmd, {'min_rank_order': min_rank_order})
-        for row in cur.fetchall():
-            row['tax_name'] = concat_name(row['_tax_name'].split('^'), row['rank'])
-            rows.append(row)
 
-    if xor(bool(args.to_rename), bool(args.taxdb)):
-        sys.exit('both --to-rename and --taxdb are required '
-                 'if one or the other is provided')
-    elif not (args.to_rename and args.taxdb):
-        writer.writerows(rows)
-        return
+def md5sum(fname, blocksize=2 ** 20):
+    """Return the md5 hex digest of file ``fname``"""
 
-    # get list of all tax_names represented among new_tax_names
-    to_rename = list(csv.DictReader(args.to_rename))
+    md5 = hashlib.md5()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            md5.update(block)
+    return md5.hexdigest()
 
-    new_tax_names = reduce(
-        set.union, [unconcat_name(row['new_tax_name'], row['new_rank'])
-                    for row in to_rename])
 
-    log.info('new tax names:')
-    log.info(pprint.pformat(new_tax_names))
+def resolve_tax_names(taxdb, tax_names):
+    """Return (taxdict, taxtable) given a collection of ``tax_names``
+    found in ``taxdb``. taxdict maps each tax_name to a tax_id, and
+    taxtable maps each tax_id in the lineages of these names to a dict
+    describing its lineage. Names are resolved in a single query, as
+    are the lineages of the corresponding tax_ids.
 
-    # retrieve tax_id(s) and lineage of each new tax_name
-    engine = sqlalchemy.create_engine('sqlite:///' + args.taxdb)
-    tax = Taxonomy(engine)
+    """
 
-    # find a tax_id correponding to each new tax_name. Substitute the
-    # original tax_id when the new tax_name cannot be found.
-    new_tax_ids = []
-    missing_tax_names = []
-    for tax_name in new_tax_names:
-        try:
-            new_tax_id, __, __ = tax.primary_from_name(tax_name)
-        except ValueError:
-            log.error(f'could not find {tax_name} in taxonomy')
-            missing_tax_names.append(tax_name)
-        else:
-            new_tax_ids.append(new_tax_id)
+    # find a tax_id correponding to each new tax_name, preferring
+    # primary names over synonyms
+    with sqlite3.connect(taxdb) as conn:
+        conn.execute('create temporary table query_names (tax_name text)')
+        conn.executemany('insert into query_names values (?)',
+                         [(tax_name,) for tax_name in tax_names])
+        taxdict = dict(conn.execute(
+            """select tax_name, tax_id from names
+            join query_names using(tax_name)
+            order by is_primary"""))
+
+    missing_tax_names = set(tax_names) - set(taxdict)
+    for tax_name in sorted(missing_tax_names):
+        log.error(f'could not find {tax_name} in taxonomy')
 
     if missing_tax_names:
         sys.exit('Error: missing tax names')
 
-    taxdict = dict(zip(new_tax_names, new_tax_ids))
-
-    log.info('taxdict: ')
-    log.info(pprint.pformat(taxdict))
+    engine = sqlalchemy.create_engine('sqlite:///' + taxdb)
+    tax = Taxonomy(engine)
 
-    lineage_rows = tax._get_lineage_table(new_tax_ids)
+    lineage_rows = tax._get_lineage_table(sorted(set(taxdict.values())))
     taxtable = {}
     for tax_id, grp in groupby(lineage_rows, lambda row: row[0]):
         __, tax_rows = as_taxtable_rows(
             grp, unordered=tax.unordered_ranks, seen=taxtable)
         taxtable.update(dict(tax_rows))
 
+    return taxdict, taxtable
+
+
+def get_taxonomy(taxdb, tax_names, cache_dir=None):
+    """Return (taxdict, taxtable) as described in resolve_tax_names().
+
+    If ``cache_dir`` is provided, results are read from and saved to a
+    json file in this directory named according to the checksum of
+    ``taxdb``, and only names not found in the cache are resolved.
+
+    """
+
+    if not cache_dir:
+        return resolve_tax_names(taxdb, tax_names)
+
+    cache_file = os.path.join(cache_dir, 'taxdb-{}.json'.format(md5sum(taxdb)))
+    try:
+        with open(cache_file) as f:
+            cache = json.load(f)
+    except FileNotFoundError:
+        cache = {'taxdict': {}, 'taxtable': {}}
+
+    taxdict, taxtable = cache['taxdict'], cache['taxtable']
+    to_resolve = set(tax_names) - set(taxdict)
+    log.info('{} of {} tax names found in {}'.format(
+        len(tax_names) - len(to_resolve), len(tax_names), cache_file))
+
+    if to_resolve:
+        new_taxdict, new_taxtable = resolve_tax_names(taxdb, to_resolve)
+        taxdict.update(new_taxdict)
+        taxtable.update(new_taxtable)
+
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = cache_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(cache, f)
+        os.replace(tmp, cache_file)
+
+    return taxdict, taxtable
+
+
+def get_rename_rules(to_rename, taxdb, cache_dir=None):
+    """Return (rename_sv, rename_taxon), dicts mapping either an sv
+    name or a tuple of (rank, tax_name) to a tuple of (new_rank,
+    lineage).
+
+    """
+
+    # get list of all tax_names represented among new_tax_names
+    to_rename = list(csv.DictReader(to_rename))
+
+    new_tax_names = reduce(
+        set.union, [unconcat_name(row['new_tax_name'], row['new_rank'])
+                    for row in to_rename])
+
+    log.info('new tax names:')
+    log.info(pprint.pformat(new_tax_names))
+
+    # retrieve tax_id(s) and lineage of each new tax_name
+    taxdict, taxtable = get_taxonomy(taxdb, new_tax_names, cache_dir)
+
+    log.info('taxdict: ')
+    log.info(pprint.pformat(taxdict))
+
     log.info('taxtable')
     log.info(pprint.pformat(taxtable))
 
@@ -255,40 +328,218 @@ def main(arguments):
         else:
             rename_taxon[(rank, tax_name)] = new
 
-    # rename taxa if necessary and write output
-    for sv_name, grp in groupby(rows, itemgetter('name')):
-        grp = list(grp)
-        ranks = {row['want_rank']: row for row in grp}
+    return rename_sv, rename_taxon
+
+
+def compile_rename_index(rename_sv, rename_taxon, all_ranks):
+    """Return a dict mapping either an sv name or a tuple of (rank,
+    tax_name) to a tuple of (new_rank, row), where row contains all
+    output values of a renamed classification following the name.
+
+    """
+
+    def compile_rule(new_rank, lineage):
+        return new_rank, (new_rank,  # want_rank
+                          new_rank,  # rank
+                          all_ranks[new_rank],
+                          lineage[new_rank],  # tax_id
+                          lineage['tax_name'],
+                          None)  # likelihood
+
+    # sv names and (rank, tax_name) tuples can't collide
+    index = {(rank, tax_name): compile_rule(*new)
+             for (rank, tax_name), new in rename_taxon.items()}
+    index.update({sv: compile_rule(*new) for sv, new in rename_sv.items()})
+    return index
+
+
+# state shared by rename_chunk() in worker processes; see init_rename()
+_rename = {}
+
+
+def init_rename(index, all_ranks):
+    _rename['index'] = index
+    _rename['all_ranks'] = all_ranks
+    _rename['ranks'] = [rank for rank, __ in sorted(all_ranks.items(), key=itemgetter(1))]
 
-        for rank, rank_order in sorted(all_ranks.items(), key=lambda x: x[1]):
-            orig = ranks.get(rank, {})
+
+def rename_chunk(chunk):
+    """Apply renaming rules to ``chunk``, a list of (sv_name, rows)
+    tuples, returning a list of output rows. Requires a previous call
+    to init_rename().
+
+    """
+
+    index, all_ranks = _rename['index'], _rename['all_ranks']
+    output = []
+    for sv_name, grp in chunk:
+        ranks = {row[WANT_RANK]: row for row in grp}
+
+        for rank in _rename['ranks']:
+            orig = ranks.get(rank)
             if not orig:
                 continue
 
-            new_rank, new_lineage = (
-                rename_sv.get(sv_name) or
-                rename_taxon.get((orig['rank'], orig['tax_name'])) or
+            new_rank, new_row = (
+                index.get(sv_name) or
+                index.get((orig[RANK], orig[TAX_NAME])) or
                 [None, None])
 
             if new_rank:
-                new_tax_id = new_lineage[new_rank]
-                row = {'name': sv_name,
-                       'want_rank': new_rank,
-                       'rank': new_rank,
-                       'rank_order': all_ranks[new_rank],
-                       'tax_id': new_tax_id,
-                       'tax_name': new_lineage['tax_name'],
-                       'likelihood': None}
-
-                ranks[new_rank] = row
+                ranks[new_rank] = (sv_name,) + new_row
                 if not rank == new_rank:
                     # delete the record for the original rank (eg,
                     # species_group replacing a species-level
                     # classification)
                     del ranks[rank]
 
-        writer.writerows(
-            sorted(ranks.values(), key=lambda row: all_ranks[row['want_rank']]))
+        output.extend(sorted(ranks.values(), key=lambda row: all_ranks[row[WANT_RANK]]))
+
+    return output
+
+
+def chunk_svs(rows, chunksize):
+    """Group ``rows`` by SV, yielding lists of up to ``chunksize``
+    (sv_name, rows) tuples.
+
+    """
+
+    chunk = []
+    for sv_name, grp in groupby(rows, itemgetter(NAME)):
+        chunk.append((sv_name, list(grp)))
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def rename_rows(rows, all_ranks, rename_sv, rename_taxon, jobs=1, chunksize=1000):
+    """Apply renaming rules to ``rows`` (as provided by
+    get_classifications()), yielding a tuple for each output row. Rows
+    are consumed one chunk of SVs at a time; if ``jobs`` > 1, chunks
+    are renamed in a pool of worker processes, and output is yielded
+    in input order.
+
+    """
+
+    index = compile_rename_index(rename_sv, rename_taxon, all_ranks)
+    chunks = chunk_svs(rows, chunksize)
+
+    if jobs == 1:
+        init_rename(index, all_ranks)
+        for chunk in chunks:
+            yield from rename_chunk(chunk)
+        return
+
+    # Limit the number of chunks submitted but not yet written to
+    # keep memory use independent of the size of the input.
+    with Pool(jobs, initializer=init_rename, initargs=(index, all_ranks)) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(rename_chunk, (chunk,)))
+            if len(pending) >= 2 * jobs:
+                yield from pending.popleft().get()
+
+        while pending:
+            yield from pending.popleft().get()
+
+
+def main(arguments):
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    inputs = parser.add_argument_group('input files')
+    inputs.add_argument(
+        'placedb', help="output of 'guppy classify' (sqlite3)")
+
+    inputs.add_argument(
+        '--to-rename', type=argparse.FileType(),
+        help="""csv file with headers 'tax_name', 'rank', 'sv',
+        'new_tax_name', 'new_rank'""")
+    inputs.add_argument(
+        '--taxdb', help="taxonomy database (sqlite3)")
+    inputs.add_argument(
+        '--taxdb-cache', metavar='DIR',
+        help="""directory for caching lineages of renamed taxa,
+        keyed by checksum of --taxdb""")
+
+    outputs = parser.add_argument_group('output files')
+    outputs.add_argument(
+        '-c', '--classifications', default=sys.stdout, type=argparse.FileType('w'),
+        help="csv file describing classification of each input (default stdout)")
+    outputs.add_argument(
+        '--parquet', metavar='FILE.parquet',
+        help="""optional parquet file with the same contents as
+        --classifications (requires pyarrow)""")
+
+    parser.add_argument('--prepare-db', action='store_true', default=False,
+                        help="""add indexes to placedb, run ANALYZE, log the
+                        query plan, and exit""")
+    parser.add_argument('--batch-size', type=int, default=10000, metavar='N',
+                        help='number of rows to fetch from placedb at a time [%(default)s]')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of parallel processes for renaming [%(default)s]')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False,
+                        help='log query plan and timing')
+    parser.add_argument('--test', action='store_true', default=False,
+                        help='run tests and exit')
+
+    args = parser.parse_args(arguments)
+
+    if args.test:
+        test_combine_lineages()
+        test_unconcat_names()
+        sys.exit()
+
+    if args.verbose:
+        log.setLevel(logging.INFO)
+
+    min_rank = 'species'
+    if args.prepare_db:
+        with sqlite3.connect(args.placedb) as conn:
+            all_ranks = dict(conn.execute('select rank, rank_order from ranks'))
+            prepare_db(conn, all_ranks[min_rank])
+        return
+
+    if xor(bool(args.to_rename), bool(args.taxdb)):
+        sys.exit('both --to-rename and --taxdb are required '
+                 'if one or the other is provided')
+
+    # renaming rules are resolved before reading the placedb so that
+    # classifications can be renamed and written as they are fetched
+    if args.to_rename and args.taxdb:
+        rename_sv, rename_taxon = get_rename_rules(
+            args.to_rename, args.taxdb, args.taxdb_cache)
+    else:
+        rename_sv, rename_taxon = None, None
+
+    writer = csv.writer(args.classifications)
+    writer.writerow(fieldnames)
+
+    with sqlite3.connect(args.placedb) as conn:
+        all_ranks = dict(conn.execute('select rank, rank_order from ranks'))
+
+        start = time.time()
+        rows = get_classifications(
+            conn, all_ranks, all_ranks[min_rank], args.batch_size)
+        if rename_sv is not None:
+            rows = rename_rows(rows, all_ranks, rename_sv, rename_taxon,
+                               jobs=args.jobs)
+
+        if args.parquet:
+            pq_writer = ParquetWriter(args.parquet)
+            for row in rows:
+                writer.writerow(row)
+                pq_writer.writerow(row)
+            pq_writer.close()
+        else:
+            writer.writerows(rows)
+
+        log.info('classifications written in {:.2f}s'.format(time.time() - start))
 
     args.classifications.close()
 
@@ -8,8 +8,8 @@ import os
 import argparse
 import logging
 import csv
+import hashlib
 import sys
-import re
 import sqlite3
 import pprint
 from functools import reduce
@@ -26,59 +26,107 @@ pd.set_option('display.width', 1000)
 
 from fastalite import Opener, fastalite
 
+from detail_dirs import safename, taxon_files
+from seqstore import SeqStore
+from squeeze import squeeze
+
 log = logging.getLogger(__name__)
 Seq = namedtuple('Seq', ['id', 'seq'])
 
 
-def safename(text):
-    return '_'.join([e for e in re.split(r'[^a-zA-Z0-9]+', text) if e])
-
+class AnnotatedSeqs(object):
+    """Provides Seq(annotated name, seq) given an original name,
+    reading sequences from a SeqStore on demand.
 
-def squeeze(seqs):
     """
-    Remove gap columns from sequences in ``seqs``
+
+    def __init__(self, store, names):
+        self.store = store
+        self.names = names
+
+    def __getitem__(self, name):
+        return Seq(self.names[name], self.store[name].seq)
+
+
+# invariant inputs to make_outputs(), populated in each worker process
+# by init_worker() so that they are not serialized for every task
+_shared = {}
+
+
+def init_worker(outdir, seqdict, hits, no_hits, tax_reps, sv_groups):
+    _shared.update(outdir=outdir, seqdict=seqdict, hits=hits, no_hits=no_hits,
+                   tax_reps=tax_reps, sv_groups=sv_groups)
+
+
+def inputs_digest(sv_names, seqs, hits_csv):
+    """Return a digest of everything written for a taxon"""
+    digest = hashlib.md5()
+    for name in sv_names:
+        digest.update('{}\n'.format(name).encode())
+    for seq in seqs:
+        digest.update('>{}\n{}\n'.format(seq.id, seq.seq).encode())
+    digest.update(hits_csv.encode())
+    return digest.hexdigest()
+
+
+def make_outputs(rank, tax_name, tax_id):
+    """Write outputs for a single taxon unless the digest of its
+    inputs matches that of the previous run. Returns (namesfile,
+    digest, updated).
+
     """
-    df = pd.DataFrame.from_records([list(seq.seq) for seq in seqs])
-    gapcols = df.apply(lambda col: set(col) == {'-'}, axis=0)
-    df = df.loc[:, ~gapcols]
-    for seq, seqstr in zip(seqs, df.apply(''.join, axis=1)):
-        yield Seq(seq.id, seqstr)
 
+    seqdict, hits, tax_reps = itemgetter('seqdict', 'hits', 'tax_reps')(_shared)
+    sv_names = _shared['sv_groups'][(rank, tax_name, tax_id)]
+    files = taxon_files(_shared['outdir'], rank, tax_name)
+
+    # hits for this set of SV's
+    hits_csv = hits.get(tax_name, _shared['no_hits']).to_csv(index=False)
+
+    # alignments for these SVs as well as relevant ref seqs
+    seqnames = (sv_names +
+                [name for t in tax_id.split(',') for name in tax_reps[t]])
+    seqs = [seqdict[name] for name in seqnames]
+
+    digest = inputs_digest(sv_names, seqs, hits_csv)
+    try:
+        with open(files['digest']) as f:
+            unchanged = (f.read().strip() == digest and
+                         all(os.path.exists(fname) for fname in files.values()))
+    except OSError:
+        unchanged = False
+
+    if unchanged:
+        log.info('{} {} (unchanged)'.format(rank, tax_name))
+        return files['sv_names'], digest, False
 
-def make_outputs(rank, tax_name, tax_id, sv_tab,
-                 # invariant args
-                 outdir, seqdict, hits, tax_reps):
     log.info('{} {}'.format(rank, tax_name))
 
     # create an output directory
-    outdir = os.path.join(outdir, rank, safename(tax_name))
     try:
-        os.makedirs(outdir)
+        os.makedirs(os.path.dirname(files['digest']))
     except OSError:
         pass
 
-    # hits for this set of SV's
-    hits.loc[hits['classif_name'] == tax_name].to_csv(
-        os.path.join(outdir, 'hits.csv'))
-
-    # alignments for these SVs as well as relevant ref seqs
-    seqnames = (list(sv_tab['name']) +
-                [name for t in tax_id.split(',') for name in tax_reps[t]])
-    seqs = [seqdict[name] for name in seqnames]
+    with open(files['hits'], 'w') as f:
+        f.write(hits_csv)
 
     # mapping of original to annotated SV names
-    namesfile = os.path.join(outdir, 'sv_names.csv')
-    with open(namesfile, 'w') as n:
+    with open(files['sv_names'], 'w') as n:
         writer = csv.writer(n)
-        for name in sv_tab['name']:
+        for name in sv_names:
             writer.writerow([name, seqdict[name].id])
 
     # alignments
-    with open(os.path.join(outdir, 'aln.fasta'), 'w') as f:
-        for seq in squeeze(seqs):
-            f.write('>{seq.id}\n{seq.seq}\n'.format(seq=seq))
+    with open(files['aln'], 'w') as f:
+        for seq, seqstr in zip(seqs, squeeze([seq.seq for seq in seqs])):
+            f.write('>{}\n{}\n'.format(seq.id, seqstr))
+
+    # written last so that an interrupted run is repeated
+    with open(files['digest'], 'w') as f:
+        f.write(digest + '\n')
 
-    return namesfile
+    return files['sv_names'], digest, True
 
 
 def get_args(arguments):
@@ -89,6 +137,9 @@ def get_args(arguments):
     inputs.add_argument('--taxonomy', type=Opener())
     inputs.add_argument('--hits', type=Opener())
     inputs.add_argument('--merged-aln', type=Opener())
+    inputs.add_argument('--seqstore', metavar='FILE',
+                        help=('read aligned sequences from a store created by '
+                              'seqstore.py instead of --merged-aln'))
 
     outputs = parser.add_argument_group('outputs')
     outputs.add_argument('-d', '--outdir', default='details',
@@ -97,6 +148,10 @@ def get_args(arguments):
                          help='list of all files containing SV names')
     outputs.add_argument('--sv-name-map', type=Opener('wt'),
                          help='mapping of original:annotated names for all SVs and refs')
+    outputs.add_argument('--manifest', type=Opener('wt'),
+                         help=('csv file describing the output directory for each taxon, '
+                               'including a digest of its contents and whether it was '
+                               'updated in this run'))
 
     parser.add_argument('-j', '--jobs', type=int, default=1,
                         help='number of parallel processes [%(default)s]')
@@ -163,15 +218,21 @@ def main(arguments):
     for rank in include_ranks:
         for tax_id, lineages in groupby(taxonomy_rows, key=itemgetter(rank)):
             child_species = {lineage['species'] for lineage in lineages} - {''}
-            tax_reps[tax_id] = reduce(
+            # sorted so that output (and its digest) is reproducible
+            tax_reps[tax_id] = sorted(reduce(
                 set.union, [set()] + [set(tax_reps[species])
-                                      for species in child_species])
+                                      for species in child_species]))
 
     # read blast hits TODO: could probably consolidate the whole
     # process of creating hits.db and all_hits.csv into this script,
     # but for now, just read and filter all_hits.csv
     hits = pd.read_csv(args.hits)
 
+    # partition hits by classification once rather than filtering all
+    # hits for each taxon
+    no_hits = hits.iloc[:0]
+    hits = dict(tuple(hits.groupby('classif_name', sort=False)))
+
     # sv_table_long provides classification results for each SV
     sv_tab = pd.read_csv(args.sv_table_long)
     sv_groups = sv_tab.groupby(['name', 'rank', 'tax_name', 'tax_id'])
@@ -192,24 +253,39 @@ def main(arguments):
     ref_names.update(sv_names)
 
     # retrieve a Seq with annotated name using original name; some may
-    # have been filtered out in sv_table.R, so we test for membership
+    # have been filtered out in sv_table.py, so we test for membership
     # in ref_names
-    seqdict = {seq.id: Seq(ref_names[seq.id], seq.seq)
-               for seq in fastalite(args.merged_aln)
-               if seq.id in ref_names}
-
-    with Pool(processes=args.jobs) as pool:
-        # assemble arguments for each taxon
-        argmap = ((rank, tax_name, tax_id, tab, args.outdir, seqdict, hits, tax_reps)
-                  for (rank, tax_name, tax_id), tab
-                  in sv_sums.groupby(['rank', 'tax_name', 'tax_id']))
-
-        result = pool.starmap_async(make_outputs, islice(argmap, args.limit))
-        namesfiles = result.get()
+    if args.seqstore:
+        seqdict = AnnotatedSeqs(SeqStore(args.seqstore), ref_names)
+    else:
+        seqdict = {seq.id: Seq(ref_names[seq.id], seq.seq)
+                   for seq in fastalite(args.merged_aln)
+                   if seq.id in ref_names}
+
+    # names of SVs for each taxon
+    sv_groups = {key: list(tab['name']) for key, tab
+                 in sv_sums.groupby(['rank', 'tax_name', 'tax_id'])}
+
+    initargs = (args.outdir, seqdict, hits, no_hits, tax_reps, sv_groups)
+    with Pool(processes=args.jobs, initializer=init_worker, initargs=initargs) as pool:
+        # each task is identified by a taxon
+        taxa = list(islice(sv_groups, args.limit))
+        results = pool.starmap_async(make_outputs, taxa).get()
+
+    namesfiles = [namesfile for namesfile, __, __ in results]
+    log.info('updated {} of {} taxa'.format(
+        sum(updated for __, __, updated in results), len(results)))
 
     if args.namesfiles:
         args.namesfiles.write('\n'.join(sorted(set(namesfiles))) + '\n')
 
+    if args.manifest:
+        writer = csv.writer(args.manifest)
+        writer.writerow(['rank', 'tax_name', 'tax_id', 'outdir', 'digest', 'updated'])
+        for (rank, tax_name, tax_id), (namesfile, digest, updated) in zip(taxa, results):
+            writer.writerow([rank, tax_name, tax_id, os.path.dirname(namesfile),
+                             digest, int(updated)])
+
     if args.sv_name_map:
         writer = csv.writer(args.sv_name_map)
         writer.writerows(ref_names.items())
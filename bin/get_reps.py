@@ -13,20 +13,35 @@ bin/get_reps.py \
     --names $out/names.csv \
     --seqs $out/seqs.fasta
 
+--sv-pattern and --ref-pattern may be provided more than once to
+select sequences matching any of the patterns (eg, several genera) in
+a single pass through the alignment. Alternatively, --queries
+specifies a csv file of labeled queries, each of which produces a
+separate set of outputs (also in a single pass).
+
+Sequence names are identified first, and the alignment is then read
+once, writing outputs for selected sequences in the order in which
+they appear. If --seqstore is used instead, reference sequences are
+written first, followed by SVs.
+
 """
 
 import argparse
 import logging
 import csv
+import os
 import sys
 import re
+from collections import defaultdict, namedtuple
 from operator import itemgetter
-from itertools import groupby
+from itertools import chain, groupby
 
 from taxtastic.refpkg import Refpkg
 
 from fastalite import Opener, fastalite
 
+from seqstore import SeqStore
+
 log = logging.getLogger(__name__)
 
 
@@ -34,11 +49,149 @@ def safename(text):
     return '_'.join([e for e in re.split(r'[^a-zA-Z0-9]', text) if e])
 
 
+def combine_patterns(patterns):
+    """Return a list of compiled expressions matching any of the
+    regular expressions in ``patterns`` (see ``search_any``). A single
+    pattern is compiled unchanged. Otherwise, patterns are combined
+    into a single expression, except for those with global inline
+    flags (eg, "(?i)"), which are valid only at the start of an
+    expression and are searched individually.
+
+    """
+
+    compiled = [re.compile(p) for p in patterns]
+    if len(compiled) == 1:
+        return compiled
+
+    default_flags = re.compile('').flags
+    plain = [p.pattern for p in compiled if p.flags == default_flags]
+    flagged = [p for p in compiled if p.flags != default_flags]
+    combined = [re.compile('|'.join('(?:{})'.format(p) for p in plain))] if plain else []
+    return combined + flagged
+
+
+def search_any(exprs, text):
+    return any(expr.search(text) for expr in exprs)
+
+
+# sv_patterns and ref_patterns are lists of regular expressions
+Query = namedtuple('Query', ['label', 'sv_patterns', 'ref_patterns', 'rm_pattern'])
+
+
+def read_queries(fobj):
+    """Return a list of Query objects from a csv file with columns
+    label, sv_pattern, ref_pattern (optional; sv_pattern is used if
+    missing), and rm_pattern (optional).
+
+    """
+
+    queries = []
+    for row in csv.DictReader(fobj):
+        sv_pattern = row['sv_pattern']
+        queries.append(Query(
+            label=row['label'],
+            sv_patterns=[sv_pattern],
+            ref_patterns=[row.get('ref_pattern') or sv_pattern],
+            rm_pattern=row.get('rm_pattern') or None))
+    return queries
+
+
+class Matcher(object):
+    """Identify which of several lists of regular expressions match a
+    string. Strings are first tested against all patterns combined
+    (see ``combine_patterns``), and results are cached, so that each
+    distinct string is compared to individual patterns at most once.
+
+    """
+
+    def __init__(self, patterns):
+        self.patterns = [combine_patterns(p) for p in patterns]
+        self.combined = combine_patterns(list(chain.from_iterable(patterns)))
+        self.cache = {}
+
+    def __call__(self, text):
+        """Return a tuple of indices of lists of patterns matching ``text``"""
+        try:
+            return self.cache[text]
+        except KeyError:
+            if search_any(self.combined, text):
+                found = tuple(i for i, p in enumerate(self.patterns) if search_any(p, text))
+            else:
+                found = ()
+            self.cache[text] = found
+            return found
+
+
+def get_refs(seq_info_lines, taxonomy, queries):
+    """Yield (seqname, i, annotation) for reference sequences with
+    species names matching ref_patterns of ``queries[i]``.
+
+    """
+
+    ref_matcher = Matcher([q.ref_patterns for q in queries])
+    rm_patterns = [q.rm_pattern and re.compile(q.rm_pattern) for q in queries]
+
+    for line in seq_info_lines:
+        if not line['species']:
+            continue
+
+        species_name = taxonomy[line['species']]['tax_name']
+        seqname = line['seqname']
+
+        annotation = '{seqname}|{organism}'.format(**line)
+        if line['is_type'] == 'True':
+            annotation += '|type'
+
+        for i in ref_matcher(species_name):
+            if not (rm_patterns[i] and rm_patterns[i].search(seqname)):
+                yield seqname, i, annotation
+
+
+def get_svs(sv_table, queries):
+    """Yield (seqname, i, annotation) for SVs in rows of sv_table_long
+    with classifications matching sv_patterns of ``queries[i]``.
+
+    """
+
+    sv_matcher = Matcher([q.sv_patterns for q in queries])
+    rm_patterns = [q.rm_pattern and re.compile(q.rm_pattern) for q in queries]
+
+    getter = itemgetter('name', 'tax_name')
+    for (seqname, tax_name), grp in groupby(sv_table, getter):
+        matches = [i for i in sv_matcher(tax_name)
+                   if not (rm_patterns[i] and rm_patterns[i].search(seqname))]
+        if matches:
+            nreads = sum(int(row['read_count']) for row in grp)
+            annotation = '{}|{}|{}'.format(seqname.split(':')[0], safename(tax_name), nreads)
+            for i in matches:
+                yield seqname, i, annotation
+
+
+def write_seq(seq, annotation, names=None, seqs=None, aln=None):
+    if names:
+        names.write('{},{}\n'.format(seq.id, annotation))
+    if seqs:
+        seqs.write('>{}\n{}\n'.format(seq.id, seq.seq.replace('-', '')))
+    if aln:
+        aln.write('>{}\n{}\n'.format(seq.id, seq.seq))
+
+
+def describe_missing(seqname, selected, queries):
+    """Return ``seqname`` followed by labels of the queries selecting
+    it (in batch mode)"""
+    labels = [queries[i].label for i, __ in selected if queries[i].label]
+    return '{} ({})'.format(seqname, ', '.join(labels)) if labels else seqname
+
+
 def get_args(arguments):
-    parser = argparse.ArgumentParser()
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument('refpkg')
     parser.add_argument('sv_table_long', type=Opener())
-    parser.add_argument('merged_aln', type=Opener())
+    parser.add_argument('merged_aln', type=Opener(), nargs='?')
+    parser.add_argument('--seqstore', metavar='FILE',
+                        help=('read aligned sequences from a store created by '
+                              'seqstore.py instead of merged_aln'))
 
     # outputs
     parser.add_argument('--seqs', type=Opener('w'),
@@ -50,15 +203,27 @@ def get_args(arguments):
                         help='csv file mapping original to annotated names')
 
     # patterns
-    parser.add_argument('--sv-pattern',
+    parser.add_argument('--sv-pattern', action='append',
                         help=('regular expression for matching taxonomic names'
-                              'of classifications'))
-    parser.add_argument('--ref-pattern',
+                              'of classifications (may be repeated)'))
+    parser.add_argument('--ref-pattern', action='append',
                         help=('regular expression for matching species names'
-                              'of ref sequences (use --sv-pattern if missing)'))
+                              'of ref sequences (use --sv-pattern if missing; '
+                              'may be repeated)'))
     parser.add_argument('--rm-pattern',
                         help='remove sequences with names matching this pattern')
 
+    # batch mode
+    batch = parser.add_argument_group(
+        'batch mode', ('select sequences for many queries in a single pass; '
+                       'outputs for each query are written to OUTDIR/<label>/ '
+                       '(names.csv, seqs.fasta, aln.fasta)'))
+    batch.add_argument('--queries', type=Opener(), metavar='FILE',
+                       help=('csv file with columns label, sv_pattern, ref_pattern, '
+                             'rm_pattern (used in place of the patterns above)'))
+    batch.add_argument('--outdir', default='reps',
+                       help='output directory for batch mode [%(default)s]')
+
     return parser.parse_args(arguments)
 
 
@@ -67,59 +232,73 @@ def main(arguments):
         level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
 
     args = get_args(arguments)
+    if not (args.seqstore or args.merged_aln):
+        sys.exit('either merged_aln or --seqstore is required')
+    if not (args.queries or args.sv_pattern):
+        sys.exit('either --sv-pattern or --queries is required')
+
     rp = Refpkg(args.refpkg)
-    seq_info_lines = list(csv.DictReader(rp.open_resource('seq_info')))
-    seq_info = {d['seqname']: d for d in seq_info_lines}
+    seq_info_lines = csv.DictReader(rp.open_resource('seq_info'))
     taxonomy = {d['tax_id']: d for d in csv.DictReader(rp.open_resource('taxonomy'))}
-    seqs = {seq.id: seq for seq in fastalite(args.merged_aln)}
-
-    rm_pattern = re.compile(r'' + args.rm_pattern) if args.rm_pattern else None
-
-    # identify reference sequences with species names matching a pattern
-    ref_pattern = re.compile(r'' + (args.ref_pattern or args.sv_pattern))
 
-    for line in seq_info_lines:
-        if not line['species']:
-            continue
-
-        species_name = taxonomy[line['species']]['tax_name']
-        seqname = line['seqname']
-
-        if not ref_pattern.search(species_name):
-            continue
-
-        if rm_pattern and rm_pattern.search(seqname):
-            continue
+    if args.queries:
+        queries = read_queries(args.queries)
+        outputs = []
+        for query in queries:
+            outdir = os.path.join(args.outdir, query.label)
+            os.makedirs(outdir, exist_ok=True)
+            outputs.append(dict(
+                names=open(os.path.join(outdir, 'names.csv'), 'w'),
+                seqs=open(os.path.join(outdir, 'seqs.fasta'), 'w'),
+                aln=open(os.path.join(outdir, 'aln.fasta'), 'w')))
+    else:
+        queries = [Query(
+            label=None,
+            sv_patterns=args.sv_pattern,
+            ref_patterns=args.ref_pattern or args.sv_pattern,
+            rm_pattern=args.rm_pattern)]
+        outputs = [dict(names=args.names, seqs=args.seqs, aln=args.aln)]
 
-        annotation = '{seqname}|{organism}'.format(**line)
-        if line['is_type'] == 'True':
-            annotation += '|type'
+    # identify reference sequences with species names matching a
+    # pattern, followed by SVs; maps seqname to a list of (query
+    # index, annotation)
+    wanted = defaultdict(list)
+    for seqname, i, annotation in chain(
+            get_refs(seq_info_lines, taxonomy, queries),
+            get_svs(csv.DictReader(args.sv_table_long), queries)):
+        wanted[seqname].append((i, annotation))
+    log.info('{} sequences selected for {} queries'.format(len(wanted), len(queries)))
 
-        seq = seqs[seqname]
-        if args.names:
-            args.names.write('{},{}\n'.format(seq.id, annotation))
-        if args.seqs:
-            args.seqs.write('>{}\n{}\n'.format(seq.id, seq.seq.replace('-', '')))
-        if args.aln:
-            args.aln.write('>{}\n{}\n'.format(seq.id, seq.seq))
+    if args.seqstore:
+        source = args.seqstore
+        store = SeqStore(args.seqstore)
+        missing = set()
+        for seqname, selected in wanted.items():
+            seq = store.get(seqname)
+            if seq is None:
+                missing.add(seqname)
+                continue
+            for i, annotation in selected:
+                write_seq(seq, annotation, **outputs[i])
+    else:
+        source = args.merged_aln.name
+        found = set()
+        for seq in fastalite(args.merged_aln):
+            for i, annotation in wanted.get(seq.id, []):
+                write_seq(seq, annotation, **outputs[i])
+                found.add(seq.id)
+        missing = wanted.keys() - found
 
-    sv_pattern = re.compile(r'' + args.sv_pattern)
-    getter = itemgetter('name', 'tax_name')
-    sv_table = csv.DictReader(args.sv_table_long)
-    for (seqname, tax_name), grp in groupby(sv_table, getter):
-        if rm_pattern and rm_pattern.search(seqname):
-            continue
+    if missing:
+        sys.exit('{} sequences not found in {}: {}'.format(
+            len(missing), source, ', '.join(
+                describe_missing(seqname, wanted[seqname], queries)
+                for seqname in sorted(missing)[:10])))
 
-        if sv_pattern.search(tax_name):
-            nreads = sum(int(row['read_count']) for row in grp)
-            annotation = '{}|{}|{}'.format(seqname.split(':')[0], safename(tax_name), nreads)
-            seq = seqs[seqname]
-            if args.names:
-                args.names.write('{},{}\n'.format(seq.id, annotation))
-            if args.seqs:
-                args.seqs.write('>{}\n{}\n'.format(seq.id, seq.seq.replace('-', '')))
-            if args.aln:
-                args.aln.write('>{}\n{}\n'.format(seq.id, seq.seq))
+    if args.queries:
+        for output in outputs:
+            for fobj in output.values():
+                fobj.close()
 
 
 if __name__ == '__main__':
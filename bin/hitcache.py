@@ -0,0 +1,74 @@
+"""Persistent cache of per-sequence results of external tools
+
+Results are stored in a sqlite database keyed by the name of the
+tool, a checksum of the reference data (eg, a database or covariance
+model), a string describing options affecting the results, and the
+SHA-1 of each sequence, so that sequences seen in earlier runs (under
+any name) are not searched again. The results for a sequence are a
+list (eg, of rows of strings) that can be serialized as JSON; an
+empty list indicates that the sequence was searched and had no
+results.
+
+"""
+
+import hashlib
+import json
+import sqlite3
+
+
+def md5sum(fname, blocksize=2 ** 20):
+    """Return the md5 hex digest of file ``fname``"""
+    md5 = hashlib.md5()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def seq_hash(seq):
+    """Return the SHA-1 hex digest of a sequence (case-insensitive)"""
+    return hashlib.sha1(seq.upper().encode()).hexdigest()
+
+
+class HitCache(object):
+    """Results for a single combination of ``tool``, ``ref`` (a
+    checksum) and ``params``.
+
+    """
+
+    def __init__(self, fname, tool, ref, params):
+        self.key = (tool, ref, params)
+        # the cache may be shared among concurrent jobs
+        self.conn = sqlite3.connect(fname, timeout=600)
+        self.conn.execute("""create table if not exists results (
+        tool text, ref text, params text, seqhash text, rows text,
+        primary key (tool, ref, params, seqhash)) without rowid""")
+        self.conn.commit()
+
+    def get(self, hashes):
+        """Return a dict of {seqhash: rows} for cached sequences among
+        ``hashes``.
+
+        """
+
+        hashes = list(hashes)
+        found = {}
+        cmd = """select seqhash, rows from results
+        where tool = ? and ref = ? and params = ? and seqhash in ({})"""
+        for start in range(0, len(hashes), 500):
+            batch = hashes[start:start + 500]
+            cursor = self.conn.execute(
+                cmd.format(', '.join('?' * len(batch))), self.key + tuple(batch))
+            found.update((seqhash, json.loads(rows)) for seqhash, rows in cursor)
+        return found
+
+    def put(self, results):
+        """Save ``results``, a dict of {seqhash: rows}"""
+        with self.conn:
+            self.conn.executemany(
+                'insert or replace into results values (?, ?, ?, ?, ?)',
+                (self.key + (seqhash, json.dumps(rows))
+                 for seqhash, rows in results.items()))
+
+    def close(self):
+        self.conn.close()
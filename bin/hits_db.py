@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+"""Create a sqlite database of vsearch hits and annotation
+
+Loads the tables queried by allhits.sql and allhits_byspecimen.sql
+(hits, ref_info, classif, seq_info, weights) with typed columns, then
+creates indexes used for joins. As with csvsql, empty cells and values
+such as "NA" or "none" are loaded as NULL.
+
+"""
+
+import argparse
+import csv
+import logging
+import os
+import sqlite3
+import sys
+import time
+from itertools import islice
+
+from classifications import read_classifications, fieldnames as classif_fields
+
+log = logging.getLogger(__name__)
+
+# values loaded as NULL (compared case-insensitively); the same as
+# the defaults used by csvsql
+null_values = {'', 'na', 'n/a', 'none', 'null', '.'}
+
+# column types for tables with known columns; columns of ref_info are
+# read from its header and are all text
+schemas = {
+    'hits': [
+        ('query', 'text'),
+        ('target', 'text'),
+        ('pct_id', 'real'),
+        ('aln_len', 'integer'),
+        ('mismatches', 'integer'),
+        ('gap_opens', 'integer'),
+        ('q_start', 'integer'),
+        ('q_end', 'integer'),
+        ('t_start', 'integer'),
+        ('t_end', 'integer'),
+        ('evalue', 'real'),
+        ('bitscore', 'real'),
+    ],
+    'classif': [
+        ('name', 'text'),
+        ('want_rank', 'text'),
+        ('rank', 'text'),
+        ('rank_order', 'integer'),
+        ('tax_id', 'text'),
+        ('tax_name', 'text'),
+        ('likelihood', 'real'),
+    ],
+    'seq_info': [
+        ('name', 'text'),
+        ('specimen', 'text'),
+    ],
+    'weights': [
+        ('name', 'text'),
+        ('name1', 'text'),
+        ('abundance', 'integer'),
+    ],
+}
+
+assert [name for name, __ in schemas['classif']] == classif_fields
+
+indexes = [
+    'create index hits_query on hits (query)',
+    'create index ref_info_seqname on ref_info (seqname)',
+    'create index classif_want_rank on classif (want_rank, name)',
+    'create index weights_name on weights (name)',
+    'create index seq_info_name on seq_info (name)',
+]
+
+
+def nulls(rows):
+    """Replace null values in each row with None"""
+    for row in rows:
+        yield [None if val is None or (isinstance(val, str) and val.lower() in null_values)
+               else val for val in row]
+
+
+def read_csv(fname, header=True):
+    """Return (fieldnames, rows) from a csv file. If ``header`` is
+    False, fieldnames is None and all rows are returned. The file is
+    closed once rows are exhausted.
+
+    """
+
+    f = open(fname, newline='')
+    reader = csv.reader(f)
+    fieldnames = next(reader) if header else None
+
+    def rows():
+        with f:
+            yield from reader
+
+    return fieldnames, rows()
+
+
+def load_table(conn, table, columns, rows, batch_size):
+    conn.execute('create table {} ({})'.format(
+        table, ', '.join('"{}" {}'.format(name, coltype) for name, coltype in columns)))
+
+    cmd = 'insert into {} values ({})'.format(table, ', '.join('?' * len(columns)))
+    rows = nulls(rows)
+    count = 0
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        conn.executemany(cmd, batch)
+        count += len(batch)
+
+    log.info('{}: {} rows'.format(table, count))
+
+
+def get_args(arguments):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('database', help='sqlite database to create (replaced if it exists)')
+    parser.add_argument('--hits', required=True,
+                        help='csv file with hits (output of blast2csv.py)')
+    parser.add_argument('--ref-info', required=True,
+                        help='csv file with reference sequence annotation')
+    parser.add_argument('--classif', required=True,
+                        help='classifications (csv or parquet)')
+    parser.add_argument('--seq-info', required=True,
+                        help='headerless csv file mapping SV names to specimens')
+    parser.add_argument('--weights', required=True,
+                        help='headerless csv file with columns name, name1, abundance')
+    parser.add_argument('--batch-size', type=int, default=100000,
+                        help='rows per executemany() call [%(default)s]')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False)
+    return parser.parse_args(arguments)
+
+
+def main(arguments):
+    args = get_args(arguments)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format="%(asctime)s %(levelname)s: %(message)s")
+
+    start = time.time()
+
+    if os.path.exists(args.database):
+        os.remove(args.database)
+
+    conn = sqlite3.connect(args.database, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=OFF')
+    conn.execute('PRAGMA synchronous=OFF')
+
+    hits_fields, hits = read_csv(args.hits)
+    if hits_fields != [name for name, __ in schemas['hits']]:
+        sys.exit('unexpected columns in {}: {}'.format(args.hits, hits_fields))
+
+    ref_fields, ref_info = read_csv(args.ref_info)
+    tables = [
+        ('hits', schemas['hits'], hits),
+        ('ref_info', [(name, 'text') for name in ref_fields], ref_info),
+        ('classif', schemas['classif'], read_classifications(args.classif)),
+        ('seq_info', schemas['seq_info'], read_csv(args.seq_info, header=False)[1]),
+        ('weights', schemas['weights'], read_csv(args.weights, header=False)[1]),
+    ]
+
+    conn.execute('begin')
+    for table, columns, rows in tables:
+        load_table(conn, table, columns, rows, args.batch_size)
+
+    for cmd in indexes:
+        log.info(cmd)
+        conn.execute(cmd)
+
+    conn.execute('commit')
+    conn.execute('analyze')
+    conn.close()
+
+    log.info('wrote {} in {:.1f}s'.format(args.database, time.time() - start))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
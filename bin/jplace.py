@@ -0,0 +1,246 @@
+"""Read and write placefiles (jplace format) incrementally
+
+``JSONStream`` decodes a placefile one top-level member and one
+placement at a time, so that memory use does not depend on the number
+of placements. ``Reader`` builds on it to yield each placement as a
+``Placement`` tuple whose rows are named and typed according to the
+"fields" member of the placefile. Files ending in .gz or .bz2 are
+decompressed transparently.
+
+pplacer and guppy write "fields" after "placements"; in this case the
+tail of the file is read first to find it (a compressed file is
+decompressed twice, but is never held in memory).
+
+"""
+
+import json
+import re
+from collections import namedtuple
+
+from fastalite import Opener
+
+# types of values in rows of "p" for fields written by pplacer;
+# values of other fields (and nulls) are left as decoded
+FIELD_TYPES = {
+    'edge_num': int,
+    'likelihood': float,
+    'like_weight_ratio': float,
+    'distal_length': float,
+    'pendant_length': float,
+    'post_prob': float,
+    'marginal_like': float,
+    'classification': str,
+    'map_ratio': float,
+    'map_overlap': int,
+}
+
+# characters read from the end of a file in search of "fields"
+TAIL_SIZE = 2 ** 16
+
+FIELDS = re.compile(rb'"fields"\s*:\s*(?=\[)')
+
+Placement = namedtuple('Placement', ['pnum', 'rows', 'names'])
+
+
+class JSONStream(object):
+    """Decode successive JSON values from a file-like object read in
+    chunks of ``chunk_size`` characters.
+
+    """
+
+    def __init__(self, fobj, chunk_size=2 ** 20):
+        self.fobj = fobj
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        """Read another chunk, discarding consumed input; return False
+        at the end of the file.
+
+        """
+
+        chunk = '' if self.eof else self.fobj.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise ValueError('unexpected end of JSON input')
+
+    def expect(self, chars):
+        """Consume and return the next non-whitespace character, which
+        must be one of ``chars``.
+
+        """
+
+        char = self.peek()
+        if char not in chars:
+            raise ValueError('expected one of {!r} at {!r}'.format(
+                chars, self.buf[self.pos:self.pos + 40]))
+        self.pos += 1
+        return char
+
+    def decode(self):
+        """Return the next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # value may be incomplete
+                if self._fill():
+                    continue
+                raise
+            # a number at the end of the buffer may be truncated
+            if end == len(self.buf) and self._fill():
+                continue
+            self.pos = end
+            return obj
+
+    def items(self, placements_key='placements'):
+        """Yield (key, value) for members of a top-level JSON object.
+        The value for ``placements_key`` is an iterator over elements
+        of the array, which must be exhausted before continuing.
+
+        """
+
+        self.expect('{')
+        if self.peek() == '}':
+            return
+        while True:
+            key = self.decode()
+            self.expect(':')
+            if key == placements_key:
+                yield key, self.elements()
+            else:
+                yield key, self.decode()
+            if self.expect(',}') == '}':
+                return
+
+    def elements(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.decode()
+            if self.expect(',]') == ']':
+                return
+
+
+class Layout(object):
+    """Named and typed columns of rows of "p" given ``fields``"""
+
+    def __init__(self, fields):
+        self.fields = list(fields)
+        self.Row = namedtuple('Row', self.fields, rename=True)
+        self.types = [FIELD_TYPES.get(field) for field in self.fields]
+
+    def row(self, values):
+        return self.Row._make(
+            val if typ is None or val is None else typ(val)
+            for typ, val in zip(self.types, values))
+
+
+def read_fields(fname, tail_size=TAIL_SIZE):
+    """Return "fields" from the last ``tail_size`` bytes of placefile
+    ``fname``, or None if not found there.
+
+    """
+
+    with Opener('rb')(fname) as f:
+        if fname.endswith(('.gz', '.bz2')):
+            # decompress without decoding, keeping the last two blocks
+            tail = b''
+            for block in iter(lambda: f.read(tail_size), b''):
+                tail = tail[-tail_size:] + block
+        else:
+            f.seek(0, 2)
+            f.seek(max(0, f.tell() - tail_size))
+            tail = f.read()
+
+    matches = list(FIELDS.finditer(tail))
+    if not matches:
+        return None
+    try:
+        fields, __ = json.JSONDecoder().raw_decode(
+            tail[matches[-1].end():].decode('utf-8', 'replace'))
+    except ValueError:
+        return None
+    if isinstance(fields, list) and all(isinstance(f, str) for f in fields):
+        return fields
+    return None
+
+
+class Reader(object):
+    """Iterate over placements in placefile ``fname``, yielding a
+    Placement (pnum, rows, names) for each: ``rows`` is a list of
+    ``layout.Row`` and ``names`` a list of (name, mass), where mass
+    is 1 for placements with "n" rather than "nm". Values in rows are
+    converted according to FIELD_TYPES unless ``convert`` is False, in
+    which case they are left as decoded (eg, to write them unchanged).
+    After iteration, ``members`` is a list of (key, value) for
+    top-level members in their original order (with None for
+    placements).
+
+    """
+
+    def __init__(self, fname, chunk_size=2 ** 20, convert=True):
+        self.fname = fname
+        self.chunk_size = chunk_size
+        self.convert = convert
+        self.members = []
+        self.layout = None
+
+    def _get_layout(self):
+        fields = read_fields(self.fname)
+        if fields is None:
+            raise ValueError('"fields" not found in {}'.format(self.fname))
+        return Layout(fields)
+
+    def __iter__(self):
+        self.members = []
+        with Opener()(self.fname) as f:
+            for key, value in JSONStream(f, self.chunk_size).items():
+                if key != 'placements':
+                    self.members.append((key, value))
+                    if key == 'fields':
+                        self.layout = Layout(value)
+                    continue
+
+                self.members.append((key, None))
+                self.layout = self.layout or self._get_layout()
+                row = self.layout.row if self.convert else self.layout.Row._make
+                for pnum, placement in enumerate(value):
+                    if 'nm' in placement:
+                        names = [(name, mass) for name, mass in placement['nm']]
+                    else:
+                        names = [(name, 1) for name in placement.get('n', [])]
+                    yield Placement(pnum, [row(values) for values in placement['p']], names)
+
+
+def write_placefile(members, placements, outfile):
+    """Write a compact placefile containing ``placements`` and the
+    other top-level ``members`` in their original order.
+
+    """
+
+    dumps = json.JSONEncoder(separators=(',', ':')).encode
+    outfile.write('{')
+    outfile.write(','.join(
+        '{}:{}'.format(dumps(key), dumps(placements if key == 'placements' else value))
+        for key, value in members))
+    outfile.write('}\n')
@@ -2,19 +2,40 @@
 
 """Annotate a wide-format taxon table given some labels
 
+The table may be a csv file or a sparse table (FILE.npz) written by
+sv_table.py; output is csv in either case.
+
 """
 
 import argparse
 import logging
 import csv
+import math
 import sys
 
 log = logging.getLogger(__name__)
 
 
+def sparse_rows(table):
+    """Yield a dict for each row of a SparseTable, filling in zeros
+    one row at a time"""
+
+    from sparse_table import iter_rows
+    from sv_table import r_format_double
+
+    for feature, indices, values in iter_rows(table):
+        row = dict(zip(table.feature_header, feature))
+        cells = ['0'] * len(table.specimens)
+        for j, val in zip(indices, values):
+            cells[j] = '' if math.isnan(val) else r_format_double(float(val))
+        row.update(zip(table.specimens, cells))
+        yield row
+
+
 def get_args(arguments):
     parser = argparse.ArgumentParser()
-    parser.add_argument('table', type=argparse.FileType('r'))
+    parser.add_argument('table', type=argparse.FileType('r'),
+                        help='csv file or sparse table (FILE.npz)')
     parser.add_argument(
         'labels', type=argparse.FileType('r'),
         help=('csv file in which values in column "specimen" '
@@ -32,24 +53,35 @@ def main(arguments):
         level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
 
     args = get_args(arguments)
-    table_reader = csv.DictReader(args.table)
+
+    if args.table.name.endswith('.npz'):
+        from sparse_table import read_sparse
+        args.table.close()
+        table = read_sparse(args.table.name)
+        fieldnames = table.feature_header + table.specimens
+        rows = sparse_rows(table)
+    else:
+        table_reader = csv.DictReader(args.table)
+        fieldnames = table_reader.fieldnames
+        rows = table_reader
+
     label_reader = csv.DictReader(args.labels)
     sample_key = label_reader.fieldnames[0]
     labels = {row[sample_key]: row for row in label_reader}
     ignore = set([sample_key] + (args.omit.split(',') if args.omit else []))
 
-    writer = csv.DictWriter(args.outfile, fieldnames=table_reader.fieldnames)
+    writer = csv.DictWriter(args.outfile, fieldnames=fieldnames)
     writer.writeheader()
     for label_name in label_reader.fieldnames:
         if label_name in ignore:
             continue
 
         row = {colname: labels.get(colname, {}).get(label_name)
-               for colname in table_reader.fieldnames}
-        row[table_reader.fieldnames[0]] = label_name
+               for colname in fieldnames}
+        row[fieldnames[0]] = label_name
         writer.writerow(row)
 
-    writer.writerows(table_reader)
+    writer.writerows(rows)
 
 
 if __name__ == '__main__':
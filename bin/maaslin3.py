@@ -23,14 +23,20 @@ RANKS = ['domain', 'phylum', 'class', 'order', 'family', 'genus', 'species']
 
 def main():
     parser = argparse.ArgumentParser(description=__doc__)
-    parser.add_argument('taxon_table_long', help='taxon_table_long.csv')
+    parser.add_argument(
+        'taxon_table_long',
+        help='taxon_table_long.csv, or a sparse taxon table (taxon_table.npz)')
     parser.add_argument('taxtable', help='taxtable.csv with lineage columns')
     parser.add_argument('-o', '--output', default=sys.stdout,
                         type=argparse.FileType('w'),
                         help='output TSV (default: stdout)')
     args = parser.parse_args()
 
-    long = pd.read_csv(args.taxon_table_long)
+    if args.taxon_table_long.endswith('.npz'):
+        from sparse_table import read_sparse, to_long
+        long = to_long(read_sparse(args.taxon_table_long))
+    else:
+        long = pd.read_csv(args.taxon_table_long)
 
     taxtable = pd.read_csv(args.taxtable, dtype=str).fillna('')
     id_to_name = taxtable.set_index('tax_id')['tax_name'].to_dict()
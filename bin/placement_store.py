@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+
+"""Place and classify sequences, reusing results of earlier runs
+
+Equivalent to ``pplacer -c refpkg merged.fasta`` followed by ``rppr
+prep_db`` and ``guppy classify`` for query sequences in ``seqs``
+(other sequences in ``merged`` are references), except that
+placements and classifications are saved in --store (a sqlite
+database; see hitcache.py) keyed by the sequence, the checksum of the
+reference package, and pplacer options. Only sequences not found in
+the store are placed and classified, and results for all sequences
+are merged to create --jplace and --classify-db.
+
+Placements in --jplace are in the order of ``seqs``. For cached
+sequences, --classify-db contains rows in tables placements,
+placement_names, and multiclass (used by get_classifications.py).
+
+--pplacer, --rppr, and --guppy may include a command prefix, for
+example, "singularity exec image.sif pplacer".
+
+"""
+
+import argparse
+import logging
+import os
+import shlex
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+from fastalite import Opener, fastalite
+
+from hitcache import HitCache, md5sum, seq_hash
+from jplace import Reader, write_placefile
+
+log = logging.getLogger(__name__)
+
+PPLACER_OPTIONS = ['-p', '--inform-prior', '--prior-lower', '0.01', '--map-identity']
+CLASSIFY_OPTIONS = ['--pp', '--classifier', 'hybrid2']
+
+# key for the top-level members of the placefile other than placements
+HEADER = 'jplace'
+
+
+def run(cmd):
+    log.info(' '.join(cmd))
+    subprocess.check_call(cmd)
+
+
+def place(args, aln, refpkg, tmpdir):
+    """Place and classify sequences in alignment ``aln``; return
+    (jplace, classify_db).
+
+    """
+
+    jplace = os.path.join(tmpdir, 'novel.jplace')
+    db = os.path.join(tmpdir, 'novel.db')
+    run(shlex.split(args.pplacer) + PPLACER_OPTIONS +
+        ['-c', refpkg, aln, '-o', jplace, '-j', str(args.jobs)])
+    run(shlex.split(args.rppr) + ['prep_db', '-c', refpkg, '--sqlite', db])
+    run(shlex.split(args.guppy) + ['classify'] + CLASSIFY_OPTIONS +
+        ['-j', str(args.jobs), jplace, '-c', refpkg, '--nbc-sequences', aln,
+         '--sqlite', db])
+    return jplace, db
+
+
+def read_results(jplace, db):
+    """Return (header, results) for placed sequences: header is a list
+    of top-level (key, value) pairs of the placefile (placements is
+    None), and results is a dict of {name: [p, mass, multiclass rows]}.
+
+    """
+
+    results = {}
+    reader = Reader(jplace, convert=False)
+    for placement in reader:
+        p = [list(row) for row in placement.rows]
+        for name, mass in placement.names:
+            results[name] = [p, mass, []]
+    header = reader.members
+
+    conn = sqlite3.connect(db)
+    cmd = 'select name, want_rank, rank, tax_id, likelihood from multiclass order by rowid'
+    for name, *row in conn.execute(cmd):
+        results[name][2].append(row)
+    conn.close()
+
+    return header, results
+
+
+def add_classifications(db, results, origin, params):
+    """Add placements and classifications for each item in ``results``
+    (a list of (name, [p, mass, multiclass rows])) to ``db``. If
+    ``db`` contains no runs (ie, all sequences were cached), a run
+    described by ``params`` is added first.
+
+    """
+
+    conn = sqlite3.connect(db)
+    columns = [row[1] for row in conn.execute('pragma table_info(placements)')]
+    placement_id = conn.execute(
+        'select coalesce(max(placement_id), 0) from placements').fetchone()[0]
+
+    with conn:
+        run_id = None
+        if 'run_id' in columns:
+            run_id = conn.execute('select max(run_id) from runs').fetchone()[0]
+            if run_id is None and results:
+                run_id = conn.execute(
+                    'insert into runs (params) values (?)', (params,)).lastrowid
+
+        for name, (__, mass, multiclass) in results:
+            placement_id += 1
+            values = {'placement_id': placement_id, 'classifier': CLASSIFY_OPTIONS[-1],
+                      'run_id': run_id}
+            cols = [c for c in columns if c in values]
+            conn.execute('insert into placements ({}) values ({})'.format(
+                ', '.join(cols), ', '.join('?' * len(cols))), [values[c] for c in cols])
+            conn.execute(
+                'insert into placement_names (placement_id, name, origin, mass) '
+                'values (?, ?, ?, ?)', (placement_id, name, origin, mass))
+            conn.executemany(
+                'insert into multiclass (placement_id, name, want_rank, rank, tax_id, likelihood) '
+                'values (?, ?, ?, ?, ?, ?)',
+                [(placement_id, name) + tuple(row) for row in multiclass])
+    conn.close()
+
+
+def get_args(arguments):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('refpkg', help='reference package')
+    parser.add_argument('merged', help='alignment of reference and query sequences')
+    parser.add_argument('seqs', help='unaligned query sequences')
+    parser.add_argument('--store', help='sqlite database of placements from earlier runs')
+    parser.add_argument('--jplace', required=True, help='output placefile')
+    parser.add_argument('--classify-db', required=True,
+                        help='output database of classifications')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of processes for pplacer and guppy [%(default)s]')
+    parser.add_argument('--pplacer', default='pplacer', help='pplacer command [%(default)s]')
+    parser.add_argument('--rppr', default='rppr', help='rppr command [%(default)s]')
+    parser.add_argument('--guppy', default='guppy', help='guppy command [%(default)s]')
+    return parser.parse_args(arguments)
+
+
+def main(arguments):
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
+
+    args = get_args(arguments)
+
+    with Opener()(args.seqs) as f:
+        hashes = [(seq.id, seq_hash(seq.seq)) for seq in fastalite(f)]
+    names = dict(hashes)
+
+    cached, store, header = {}, None, None
+    if args.store:
+        refpkg_md5 = md5sum(os.path.join(args.refpkg, 'CONTENTS.json'))
+        params = ' '.join(PPLACER_OPTIONS + CLASSIFY_OPTIONS)
+        store = HitCache(args.store, 'pplacer', refpkg_md5, params)
+        cached = store.get(names.values())
+        stored_header = store.get([HEADER]).get(HEADER)
+        header = stored_header and [tuple(item) for item in stored_header]
+
+    novel = {name for name, seqhash in hashes if seqhash not in cached}
+    if store:
+        log.info('{} of {} sequences found in {}'.format(
+            len(hashes) - len(novel), len(hashes), args.store))
+
+    with tempfile.TemporaryDirectory(dir='.') as tmpdir:
+        results, origin = {}, os.path.basename(args.jplace)
+        if novel or not header:
+            # place references and novel query sequences
+            aln = os.path.join(tmpdir, 'novel.fasta')
+            with Opener()(args.merged) as f, open(aln, 'w') as outfile:
+                for seq in fastalite(f):
+                    if seq.id in novel or seq.id not in names:
+                        outfile.write('>{}\n{}\n'.format(seq.id, seq.seq))
+
+            jplace, db = place(args, aln, args.refpkg, tmpdir)
+            header, results = read_results(jplace, db)
+            shutil.copyfile(db, args.classify_db)
+            origin = os.path.basename(jplace)
+        else:
+            # all sequences are cached: create an empty database
+            if os.path.exists(args.classify_db):
+                os.remove(args.classify_db)
+            run(shlex.split(args.rppr) + ['prep_db', '-c', args.refpkg,
+                                          '--sqlite', args.classify_db])
+
+    missing = novel - results.keys()
+    if missing:
+        log.warning('{} sequences were not placed: {}'.format(
+            len(missing), ', '.join(sorted(missing)[:10])))
+        hashes = [(name, seqhash) for name, seqhash in hashes if name not in missing]
+
+    # results are saved without names; identical sequences with
+    # different names are saved once
+    if store:
+        new = {}
+        for name, seqhash in hashes:
+            if name in results and seqhash not in new:
+                new[seqhash] = results[name]
+        new[HEADER] = header
+        store.put(new)
+        store.close()
+
+    # describe the run using the invocation of pplacer that placed
+    # the cached sequences
+    metadata = dict(header).get('metadata') or {}
+    add_classifications(
+        args.classify_db,
+        [(name, cached[seqhash]) for name, seqhash in hashes if name not in results],
+        origin,
+        metadata.get('invocation') or ' '.join(['pplacer'] + PPLACER_OPTIONS))
+
+    placements = []
+    for name, seqhash in hashes:
+        p, mass, __ = results.get(name) or cached[seqhash]
+        placements.append({'p': p, 'nm': [[name, mass]]})
+
+    with open(args.jplace, 'w') as f:
+        write_placefile(header, placements, f)
+
+    log.info('wrote {} placements ({} placed)'.format(len(placements), len(results)))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
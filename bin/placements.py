@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+"""Extract placement details from a .jplace file
+
+The placefile (which may be compressed, eg redup.jplace.gz) is read
+one placement at a time (see jplace.py), so memory use does not depend
+on its size. Values are written as they appear in the placefile.
+
+"""
+
+import sys
+import argparse
+import csv
+
+from fastalite import Opener
+
+from jplace import Reader
+
+
+def main(arguments):
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('jplace', help=".jplace file (may be compressed)")
+    parser.add_argument('-d', '--details', help="table of placement details",
+                        type=Opener('w'))
+    parser.add_argument('-n', '--names', help="table of read names and placement ids",
+                        type=Opener('w'))
+
+    args = parser.parse_args(arguments)
+
+    reader = Reader(args.jplace, convert=False)
+
+    if args.names:
+        pnames = csv.writer(args.names)
+        pnames.writerow(['pnum', 'name', 'weight'])
+
+    details = None
+    for p in reader:
+        if args.details and not details:
+            # fields are known once the first placement is read
+            details = csv.writer(args.details)
+            details.writerow(['pnum'] + reader.layout.fields)
+        if args.names:
+            pnames.writerows([p.pnum, name, weight] for name, weight in p.names)
+        if details:
+            details.writerows([p.pnum] + list(row) for row in p.rows)
+
+    if args.details and not details and reader.layout:
+        csv.writer(args.details).writerow(['pnum'] + reader.layout.fields)
+
+    for fobj in [args.details, args.names]:
+        if fobj and fobj is not sys.stdout:
+            fobj.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -2,56 +2,114 @@
 
 """Replace all occurrences of OLD with NEW in infile given csv file of OLD,NEW
 
+The placefile is read incrementally: top-level members other than
+"placements" are copied (with leaf names in the tree replaced), and
+placements are renamed and written one at a time, so that the whole
+file is never held in memory. Output is compact JSON, compressed if
+outfile ends with .gz or .bz2.
+
+Placements containing names missing from mapfile (eg, SVs removed in
+an earlier step) are written unchanged.
+
 """
 
-from __future__ import print_function
 import sys
 import argparse
 import csv
 import json
+import logging
 import re
 
+from fastalite import Opener
+
+from jplace import JSONStream
+
+log = logging.getLogger(__name__)
+
+# delimiters separating labels and branch lengths in a newick string
+TREE_DELIMS = re.compile(r'([(),:;{}\[\]])')
+
+
+def rename_tree(tree, replacements):
+    """Replace leaf names in newick string ``tree`` (ie, labels
+    preceded by "(" or "," and followed by ":").
+
+    """
+
+    tokens = TREE_DELIMS.split(tree)
+    # labels are at even indices, delimiters at odd
+    for i in range(2, len(tokens) - 1, 2):
+        if tokens[i - 1] in '(,' and tokens[i + 1] == ':':
+            tokens[i] = replacements.get(tokens[i], tokens[i])
+    return ''.join(tokens)
+
+
+def rename_placements(placements, replacements, counts):
+    """Yield placements with names in 'n' (a list of names) or 'nm' (a
+    list of [name, mass]) replaced. Placements with any unmapped name
+    are yielded unchanged. Updates ``counts`` with the number of names
+    and of names not mapped.
+
+    """
+
+    for placement in placements:
+        names = list(placement.get('n', []))
+        names += [name for name, __ in placement.get('nm', [])]
+        counts['names'] += len(names)
+        unmapped = sum(name not in replacements for name in names)
+        if unmapped:
+            counts['unmapped'] += unmapped
+        else:
+            if 'n' in placement:
+                placement['n'] = [replacements[name] for name in placement['n']]
+            if 'nm' in placement:
+                placement['nm'] = [[replacements[name], mass]
+                                   for name, mass in placement['nm']]
+        yield placement
+
+
+def write_jplace(items, outfile, replacements, counts):
+    dumps = json.JSONEncoder(separators=(',', ':')).encode
+    outfile.write('{')
+    for i, (key, value) in enumerate(items):
+        outfile.write('{}{}:'.format(',' if i else '', dumps(key)))
+        if key == 'placements':
+            outfile.write('[')
+            for j, placement in enumerate(rename_placements(value, replacements, counts)):
+                if j:
+                    outfile.write(',')
+                outfile.write(dumps(placement))
+            outfile.write(']')
+        elif key == 'tree':
+            outfile.write(dumps(rename_tree(value, replacements)))
+        else:
+            outfile.write(dumps(value))
+    outfile.write('}\n')
+
 
 def main(arguments):
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
 
     parser = argparse.ArgumentParser(
         description=__doc__,
         formatter_class=argparse.RawDescriptionHelpFormatter)
-    parser.add_argument('infile', help="jplace file", type=argparse.FileType('r'))
+    parser.add_argument('infile', help="jplace file", type=Opener())
     parser.add_argument('mapfile', help="csv file mapping OLD to NEW ",
                         type=argparse.FileType('r'))
     parser.add_argument('-o', '--outfile', help="Output file",
-                        default=sys.stdout, type=argparse.FileType('w'))
+                        default=sys.stdout, type=Opener('wt'))
 
     args = parser.parse_args(arguments)
 
     replacements = dict(csv.reader(args.mapfile))
-    data = json.load(args.infile)
-
-    # replacements in tree
-    def repl(matchobj):
-        match = matchobj.group(0)
-        try:
-            return match[0] + replacements[match[1:-1]] + match[-1]
-        except KeyError:
-            # not represented in replacements
-            return match
-
-    tree = data['tree']
-    data['tree'] = re.sub(r'[(,]([A-Z_0-9-]+):', repl, tree, flags=re.I)
-
-    # replacements among placements names
-    placements = data['placements'].copy()
-    for placement in placements:
-        try:
-            placement['nm'] = [[replacements[label], count] for label, count in placement['nm']]
-        except KeyError:
-            # placefile may contain SVs that were removed in an earlier step
-            # TODO: retain dropped SVs upstream?
-            continue
-
-    data['placements'] = placements
-    json.dump(data, args.outfile, indent=2)
+
+    counts = {'names': 0, 'unmapped': 0}
+    write_jplace(JSONStream(args.infile).items(), args.outfile, replacements, counts)
+    if args.outfile is not sys.stdout:
+        args.outfile.close()
+
+    log.info('{unmapped} of {names} placement names were not mapped'.format(**counts))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+"""Create an indexed sequence store from a fasta file
+
+A store named ``FILE.seqstore`` consists of two files:
+
+* ``FILE.seqstore`` - sequences concatenated without headers (each
+  followed by a newline), read via mmap
+* ``FILE.seqstore.idx`` - a tab-delimited index with columns id,
+  offset, length, and description (the full fasta header line)
+
+Opening a store reads only the index, so retrieving a sequence by id
+does not require parsing the entire alignment or holding it in
+memory.
+
+"""
+
+import argparse
+import logging
+import mmap
+import sys
+from collections import namedtuple
+
+from fastalite import Opener, fastalite
+
+log = logging.getLogger(__name__)
+
+# the same fields as records returned by fastalite
+Seq = namedtuple('Seq', ['id', 'description', 'seq'])
+
+
+def index_path(fname):
+    return str(fname) + '.idx'
+
+
+class SeqStoreWriter(object):
+    """Write sequences to a store one at a time"""
+
+    def __init__(self, fname):
+        self.data = open(fname, 'wb')
+        self.index = open(index_path(fname), 'w')
+        self.offset = 0
+
+    def write(self, seq):
+        """Add a record with attributes id, description, and seq (str
+        or bytes)"""
+        data = seq.seq if isinstance(seq.seq, bytes) else seq.seq.encode('ascii')
+        self.data.write(data + b'\n')
+        self.index.write('{}\t{}\t{}\t{}\n'.format(
+            seq.id, self.offset, len(data), seq.description))
+        self.offset += len(data) + 1
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class SeqStore(object):
+    """Read-only mapping of sequence id to Seq(id, description, seq)
+    for a store created by SeqStoreWriter. Iteration yields records in
+    the order in which they were written.
+
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.ids = []
+        self.positions = {}
+        self.descriptions = []
+        with open(index_path(fname)) as f:
+            for i, line in enumerate(f):
+                seqid, offset, length, description = line.rstrip('\n').split('\t', 3)
+                self.ids.append(seqid)
+                self.positions[seqid] = (i, int(offset), int(length))
+                self.descriptions.append(description)
+
+        self._file = open(fname, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # an empty file can't be mapped
+            self._mmap = b''
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, seqid):
+        return seqid in self.positions
+
+    def __getitem__(self, seqid):
+        i, offset, length = self.positions[seqid]
+        return Seq(seqid, self.descriptions[i],
+                   self._mmap[offset:offset + length].decode('ascii'))
+
+    def get(self, seqid, default=None):
+        return self[seqid] if seqid in self.positions else default
+
+    def __iter__(self):
+        for seqid in self.ids:
+            yield self[seqid]
+
+    def close(self):
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def write_seqstore(seqs, fname):
+    """Write records ``seqs`` to a store, returning the number written"""
+    count = 0
+    with SeqStoreWriter(fname) as writer:
+        for seq in seqs:
+            writer.write(seq)
+            count += 1
+    return count
+
+
+def get_args(arguments):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('fasta', type=Opener(), help='input fasta file')
+    parser.add_argument('seqstore', help='name of the store to create')
+    return parser.parse_args(arguments)
+
+
+def main(arguments):
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
+
+    args = get_args(arguments)
+    count = write_seqstore(fastalite(args.fasta), args.seqstore)
+    log.info('wrote {} sequences to {}'.format(count, args.seqstore))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
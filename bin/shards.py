@@ -0,0 +1,45 @@
+"""Divide a fasta file into shards of contiguous sequences
+
+"""
+
+import os
+
+from fastalite import Opener, fastalite
+
+
+def write_shards(fname, nshards, dirname, include=None):
+    """Divide sequences in ``fname`` into at most ``nshards`` fasta
+    files of contiguous sequences in ``dirname``; return a list of
+    file names. If ``include`` is provided, only sequences with ids in
+    this set are written.
+
+    """
+
+    with Opener()(fname) as f:
+        if include is None:
+            count = sum(1 for line in f if line.startswith('>'))
+        else:
+            count = sum(1 for seq in fastalite(f) if seq.id in include)
+
+    size = max(1, -(-count // nshards))
+    shards = [os.path.join(dirname, 'shard{}.fasta'.format(i))
+              for i in range(max(1, -(-count // size)))]
+
+    outfile = None
+    with Opener()(fname) as f:
+        seqs = fastalite(f)
+        if include is not None:
+            seqs = (seq for seq in seqs if seq.id in include)
+        for i, seq in enumerate(seqs):
+            if i % size == 0:
+                if outfile:
+                    outfile.close()
+                outfile = open(shards[i // size], 'w')
+            outfile.write('>{}\n{}\n'.format(seq.description, seq.seq))
+
+    if outfile:
+        outfile.close()
+    else:
+        open(shards[0], 'w').close()
+
+    return shards
@@ -0,0 +1,118 @@
+"""Read and write wide feature x specimen tables in a sparse format
+
+A table named ``FILE.npz`` is stored as three files:
+
+* ``FILE.npz`` - a scipy.sparse CSR matrix with a row for each
+  feature (SV or taxon) and a column for each specimen
+* ``FILE.features.csv`` - labels for each row of the matrix, with a
+  header (eg, "name,tax_name" or "tax_name")
+* ``FILE.specimens.csv`` - a single column "specimen" naming each
+  column of the matrix
+
+Values of zero are not stored, so these files are a small fraction of
+the size of the equivalent csv files (eg, sv_table.csv) for tables
+with many specimens.
+
+"""
+
+import csv
+from collections import namedtuple
+
+import numpy as np
+from scipy import sparse
+
+SparseTable = namedtuple('SparseTable', ['matrix', 'feature_header', 'features', 'specimens'])
+
+
+def is_sparse(fname):
+    return str(fname).endswith('.npz')
+
+
+def index_paths(fname):
+    """Return the names of the files containing feature and specimen
+    labels for sparse table ``fname``.
+
+    """
+
+    base = str(fname)[:-len('.npz')] if is_sparse(fname) else str(fname)
+    return base + '.features.csv', base + '.specimens.csv'
+
+
+def write_sparse(fname, matrix, feature_header, features, specimens):
+    """Write csr_matrix ``matrix`` to ``fname`` along with index
+    files. ``features`` is a sequence of tuples with elements
+    corresponding to ``feature_header``.
+
+    """
+
+    matrix = sparse.csr_matrix(matrix)
+    if matrix.shape != (len(features), len(specimens)):
+        raise ValueError('matrix has shape {} but labels have shape {}'.format(
+            matrix.shape, (len(features), len(specimens))))
+
+    sparse.save_npz(fname, matrix, compressed=True)
+
+    features_file, specimens_file = index_paths(fname)
+    with open(features_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(feature_header)
+        writer.writerows(features)
+
+    with open(specimens_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['specimen'])
+        writer.writerows([specimen] for specimen in specimens)
+
+
+def read_sparse(fname):
+    """Return a SparseTable given the name of an .npz file written by
+    write_sparse(). Labels are strings.
+
+    """
+
+    matrix = sparse.load_npz(fname).tocsr()
+    features_file, specimens_file = index_paths(fname)
+
+    with open(features_file, newline='') as f:
+        reader = csv.reader(f)
+        feature_header = next(reader)
+        features = [tuple(row) for row in reader]
+
+    with open(specimens_file, newline='') as f:
+        reader = csv.reader(f)
+        next(reader)
+        specimens = [row[0] for row in reader]
+
+    return SparseTable(matrix, feature_header, features, specimens)
+
+
+def iter_rows(table):
+    """Yield (feature, indices, values) for each row of SparseTable
+    ``table``, where ``indices`` are the positions in
+    ``table.specimens`` of the stored ``values``.
+
+    """
+
+    mat = table.matrix
+    for i, feature in enumerate(table.features):
+        start, end = mat.indptr[i], mat.indptr[i + 1]
+        yield feature, mat.indices[start:end], mat.data[start:end]
+
+
+def to_long(table):
+    """Return a pandas DataFrame with columns for the feature labels,
+    'specimen', and 'read_count' containing a row for each stored
+    value in SparseTable ``table``.
+
+    """
+
+    import pandas as pd
+
+    coo = table.matrix.tocoo()
+    specimens = np.array(table.specimens, dtype=object)
+
+    df = pd.DataFrame.from_records(
+        [table.features[i] for i in coo.row], columns=table.feature_header)
+    df['specimen'] = specimens[coo.col]
+    df['read_count'] = coo.data
+    return df
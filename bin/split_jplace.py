@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+"""Write subsets of a placefile for many sets of names in one pass
+
+Replaces ``guppy filter`` (see filter_jplace.py) for each taxon in
+the output of get_details.py. ``namesfiles`` lists csv files with rows
+"oldname,newname"; for each, a placefile named ``--outname`` is
+written to the same directory containing placements of sequences
+named in the second column. Names are compared exactly (not as
+regular expressions). Placements with several names are included in
+each subset containing any of them, retaining only the names in that
+subset. Selected placements are held in memory until the input has
+been read.
+
+"""
+
+import argparse
+import csv
+import logging
+import os
+import sys
+from collections import defaultdict
+
+from fastalite import Opener
+
+from jplace import JSONStream, write_placefile
+
+log = logging.getLogger(__name__)
+
+
+def read_names(fname):
+    """Return the set of names in the second column of csv file ``fname``"""
+    with open(fname, newline='') as f:
+        return {row[1] for row in csv.reader(f) if row}
+
+
+def split_placements(items, namesets):
+    """Divide placements among subsets defined by a list of sets of
+    names ``namesets``. ``items`` yields top-level (key, value) pairs
+    of a placefile (see ``JSONStream.items``). Returns (members,
+    subsets): a list of (key, value) for members other than
+    placements (value is None for placements), and a list containing
+    a list of placements for each set of names.
+
+    """
+
+    # map each name to the indices of subsets containing it
+    index = defaultdict(list)
+    for i, names in enumerate(namesets):
+        for name in names:
+            index[name].append(i)
+
+    members = []
+    subsets = [[] for __ in namesets]
+    for key, value in items:
+        if key != 'placements':
+            members.append((key, value))
+            continue
+
+        members.append((key, None))
+        for placement in value:
+            # 'n' is a list of names, 'nm' of [name, mass]
+            namekey = 'nm' if 'nm' in placement else 'n'
+            matches = defaultdict(list)
+            for name in placement.get(namekey, []):
+                for i in index.get(name[0] if namekey == 'nm' else name, []):
+                    matches[i].append(name)
+            for i, names in matches.items():
+                subsets[i].append(dict(placement, **{namekey: names}))
+
+    return members, subsets
+
+
+def get_args(arguments):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('jplace', type=Opener(), help='placefile (may be compressed)')
+    parser.add_argument('namesfiles', type=Opener(),
+                        help='file listing csv files of names, one per line')
+    parser.add_argument('--outname', default='combined.jplace',
+                        help='name of each output file [%(default)s]')
+    return parser.parse_args(arguments)
+
+
+def main(arguments):
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
+
+    args = get_args(arguments)
+
+    namesfiles = [line.strip() for line in args.namesfiles if line.strip()]
+    namesets = [read_names(fname) for fname in namesfiles]
+
+    members, subsets = split_placements(JSONStream(args.jplace).items(), namesets)
+
+    for fname, placements in zip(namesfiles, subsets):
+        outfile = os.path.join(os.path.dirname(fname), args.outname)
+        with open(outfile, 'w') as f:
+            write_placefile(members, placements, f)
+
+    log.info('wrote {} placefiles containing {} placements'.format(
+        len(subsets), sum(len(p) for p in subsets)))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+"""Remove columns consisting entirely of gaps from an alignment
+
+Replaces ``seqmagick convert --include-from-file names.txt --squeeze``
+for large alignments. Sequences are written on a single line.
+
+"""
+
+import argparse
+import logging
+import sys
+
+import numpy as np
+
+from fastalite import Opener, fastalite
+
+log = logging.getLogger(__name__)
+
+GAP = ord('-')
+
+
+def gap_mask(seqs, gap=GAP):
+    """Return a tuple (arr, mask): a 2-D uint8 array containing
+    aligned sequences ``seqs`` (a list of str or bytes) and a boolean
+    array identifying columns with at least one non-gap character.
+
+    """
+
+    if not seqs:
+        return np.zeros((0, 0), dtype=np.uint8), np.zeros(0, dtype=bool)
+
+    seqs = [s.encode('ascii') if isinstance(s, str) else s for s in seqs]
+    width = len(seqs[0])
+    if any(len(s) != width for s in seqs):
+        raise ValueError('sequences are not aligned (lengths differ)')
+
+    arr = np.frombuffer(b''.join(seqs), dtype=np.uint8).reshape(len(seqs), width)
+    return arr, (arr != gap).any(axis=0)
+
+
+def squeeze(seqs):
+    """Return a list of strings containing ``seqs`` without columns
+    consisting only of gaps.
+
+    """
+
+    arr, mask = gap_mask(seqs)
+    squeezed = arr[:, mask]
+    return [row.tobytes().decode('ascii') for row in squeezed]
+
+
+def get_args(arguments):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('infile', type=Opener(), help='input alignment in fasta format')
+    parser.add_argument('outfile', type=Opener('wt'), help='output fasta file')
+    parser.add_argument('--include-from-file', type=Opener(), metavar='FILE',
+                        help='include only sequences with ids listed in FILE')
+    return parser.parse_args(arguments)
+
+
+def main(arguments):
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
+
+    args = get_args(arguments)
+
+    seqs = fastalite(args.infile)
+    if args.include_from_file:
+        include = {line.strip() for line in args.include_from_file if line.strip()}
+        seqs = (seq for seq in seqs if seq.id in include)
+
+    seqs = list(seqs)
+    for seq, seqstr in zip(seqs, squeeze([seq.seq for seq in seqs])):
+        args.outfile.write('>{}\n{}\n'.format(seq.description, seqstr))
+
+    log.info('wrote {} sequences'.format(len(seqs)))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,609 @@
+#!/usr/bin/env python3
+
+"""Create tables of SVs and taxa by specimen
+
+A reimplementation of sv_table.R with the same command line interface
+and outputs. Input columns are typed according to the rules used by
+R's read.csv(), and outputs are formatted as by write.csv(), so that
+files are identical to those produced by sv_table.R when character
+values are sorted in the C locale (as by dplyr >= 1.1).
+
+Each column is held as an array of integer codes indexing its sorted
+distinct values (see Column), so that joins, group-bys and pivots are
+performed on NumPy arrays, and each distinct value is typed and
+formatted only once. Wide tables are assembled as sparse specimen x
+feature matrices.
+
+"""
+
+import argparse
+import csv
+import logging
+import math
+import re
+import sys
+from collections import namedtuple
+
+import numpy as np
+from scipy import sparse
+
+from classifications import is_parquet
+from sparse_table import write_sparse
+
+log = logging.getLogger(__name__)
+
+INT_MAX = 2 ** 31 - 1
+int_pattern = re.compile(r'[-+]?\d+')
+float_pattern = re.compile(
+    r'[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?|[-+]?(Inf|inf|NaN)')
+
+# R column types, used to determine sorting and formatting of values
+CHARACTER, INTEGER, DOUBLE = 'character', 'integer', 'double'
+
+# A column of type ``rtype`` with values ``levels[codes]``: levels is a
+# sorted array of distinct values, and NA is coded as len(levels), so
+# that sorting by code places NA last.
+Column = namedtuple('Column', ['rtype', 'levels', 'codes'])
+
+
+class RError(Exception):
+    """Raised where sv_table.R would stop with an error"""
+
+
+def r_type(values):
+    """Return the type that R's type.convert() would assign to a
+    column of strings ``values``.
+
+    """
+
+    values = [v for v in values if v not in ('NA', '')]
+    if all(int_pattern.fullmatch(v) and abs(int(v)) <= INT_MAX for v in values):
+        return INTEGER
+    elif all(float_pattern.fullmatch(v) for v in values):
+        return DOUBLE
+    else:
+        return CHARACTER
+
+
+def r_column(values, rtype=None):
+    """Return a Column given a sequence of strings ``values``. Only
+    distinct strings are typed and converted.
+
+    """
+
+    strings, codes = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+    rtype = rtype or r_type(strings)
+    is_na = np.isin(strings, ['NA'] if rtype == CHARACTER else ['NA', ''])
+
+    if rtype == CHARACTER:
+        levels, lookup = strings[~is_na], np.arange((~is_na).sum())
+    else:
+        # distinct strings may have the same value (eg, "1" and "01")
+        levels, lookup = np.unique(
+            strings[~is_na].astype(np.int64 if rtype == INTEGER else float),
+            return_inverse=True)
+
+    recode = np.full(len(strings), len(levels))
+    recode[~is_na] = lookup.ravel()
+    return Column(rtype, levels, recode[codes.ravel()])
+
+
+def read_table(fname, colnames=None):
+    """Read a csv file, returning a dict of column name: Column.
+    Column names are read from the first line of the file unless
+    ``colnames`` is provided.
+
+    """
+
+    if is_parquet(fname):
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(fname)
+        columns = {name: ['NA' if v is None else str(v) for v in table[name].to_pylist()]
+                   for name in table.column_names}
+    else:
+        with open(fname, newline='') as f:
+            reader = csv.reader(f)
+            header = colnames or next(reader)
+            columns = dict(zip(header, list(zip(*reader)) or [()] * len(header)))
+
+    return {name: r_column(values) for name, values in columns.items()}
+
+
+def level(col, code):
+    """Return the value of ``col`` for ``code`` (None for NA)"""
+    return None if code == len(col.levels) else col.levels[code].item()
+
+
+def to_list(col):
+    """Return values of ``col`` as a list (with None for NA)"""
+    return np.append(col.levels.astype(object), None)[col.codes].tolist()
+
+
+def numeric(col):
+    """Return values of numeric ``col`` as floats (with nan for NA)"""
+    return np.append(col.levels.astype(float), np.nan)[col.codes]
+
+
+def match(x, table):
+    """Return the index of each element of ``x`` in sorted array
+    ``table``, or -1 if absent. Strings never match numbers.
+
+    """
+
+    if not len(table) or (x.dtype.kind in 'SU') != (table.dtype.kind in 'SU'):
+        return np.full(len(x), -1)
+    ix = np.minimum(np.searchsorted(table, x), len(table) - 1)
+    return np.where(table[ix] == x, ix, -1)
+
+
+def recode(codes, levels, new_levels):
+    """Return ``codes`` for ``levels`` as codes for ``new_levels``,
+    with -1 for values not found there (NA remains NA).
+
+    """
+
+    return np.append(match(levels, new_levels), len(new_levels))[codes]
+
+
+def subset(table, ix):
+    """Return dict of Columns ``table`` with rows selected by ``ix``"""
+    return {name: col._replace(codes=col.codes[ix]) for name, col in table.items()}
+
+
+def distinct(*codes):
+    """Return the distinct combinations of arrays ``codes`` as rows of
+    an array in sorted order, the index of the combination for each
+    element, and the index of the first element with each combination.
+
+    """
+
+    order = np.lexsort(codes[::-1])
+    keys = np.column_stack(codes).reshape(-1, len(codes))[order]
+    is_first = np.ones(len(order), dtype=bool)
+    is_first[1:] = (keys[1:] != keys[:-1]).any(axis=1)
+    inverse = np.empty(len(order), dtype=int)
+    inverse[order] = np.cumsum(is_first) - 1
+    return keys[is_first], inverse, order[is_first]
+
+
+def left_join(left, right, size):
+    """Return arrays (i, j) pairing each element of ``left`` with each
+    equal element of ``right``, in the order of ``left`` and then of
+    ``right``; j is -1 for elements of ``left`` without a match.
+    Elements of ``left`` are codes less than ``size``, and negative
+    elements of ``right`` are never matched.
+
+    """
+
+    order = np.argsort(right, kind='stable')
+    order = order[right[order] >= 0]
+    counts = np.bincount(right[order], minlength=size)
+    starts = np.cumsum(counts) - counts
+
+    nmatch = counts[left]
+    reps = np.maximum(nmatch, 1)
+    i = np.repeat(np.arange(len(left)), reps)
+    offset = np.arange(len(i)) - np.repeat(np.cumsum(reps) - reps, reps)
+
+    j = np.full(len(i), -1)
+    matched = np.repeat(nmatch > 0, reps)
+    j[matched] = order[np.repeat(starts[left], reps)[matched] + offset[matched]]
+    return i, j
+
+
+def r_format_double(x):
+    """Format float ``x`` as R's write.csv() (ie, with 15 significant
+    digits, preferring fixed notation unless scientific notation is
+    narrower).
+
+    """
+
+    if math.isinf(x):
+        return 'Inf' if x > 0 else '-Inf'
+    if x == 0:
+        return '0'
+
+    mantissa, exponent = ('%.14e' % x).split('e')
+    exponent = int(exponent)
+    nsig = len(mantissa.lstrip('-').replace('.', '').rstrip('0'))
+    neg = 1 if x < 0 else 0
+
+    if exponent >= 0:
+        rgt = max(0, nsig - exponent - 1)
+        fixed_width = neg + exponent + 1 + (rgt + 1 if rgt else 0)
+    else:
+        rgt = nsig - exponent - 1
+        fixed_width = neg + 1 + rgt + 1
+
+    sci_width = neg + (nsig + 1 if nsig > 1 else 1) + (5 if abs(exponent) >= 100 else 4)
+
+    if fixed_width <= sci_width:
+        return '%.*f' % (rgt, x)
+    else:
+        return '%.*e' % (nsig - 1, x)
+
+
+def r_format(value, rtype, na='NA', quote=True):
+    if value is None or (rtype == DOUBLE and math.isnan(value)):
+        return na
+    elif rtype == CHARACTER:
+        return '"{}"'.format(value.replace('"', '""')) if quote else value
+    elif rtype == DOUBLE:
+        return r_format_double(value)
+    else:
+        return str(value)
+
+
+def format_levels(col, na='NA', quote=True):
+    """Return an object array of the formatted levels of ``col``
+    followed by ``na``, which may be indexed by ``col.codes``.
+
+    """
+
+    return np.array([r_format(v, col.rtype, na, quote) for v in col.levels.tolist()] + [na],
+                    dtype=object)
+
+
+def write_csv(fname, header, columns, na='NA', chunk_size=2 ** 16):
+    """Write Columns ``columns`` to ``fname`` as R's write.csv(...,
+    row.names=FALSE), ``chunk_size`` rows at a time.
+
+    """
+
+    labels = [format_levels(col, na) for col in columns]
+    nrows = len(columns[0].codes) if columns else 0
+
+    with open(fname, 'w') as f:
+        f.write(','.join(r_format(name, CHARACTER) for name in header) + '\n')
+        for start in range(0, nrows, chunk_size):
+            rows = slice(start, start + chunk_size)
+            lines = labels[0][columns[0].codes[rows]]
+            for col_labels, col in zip(labels[1:], columns[1:]):
+                lines = lines + ',' + col_labels[col.codes[rows]]
+            f.writelines(lines + '\n')
+
+
+def write_wide(fname, header, labels, mat, na='NA', nan_cols=None):
+    """Write a table with Columns ``labels`` followed by columns of
+    sparse matrix ``mat``, formatting values as doubles. Implicit
+    zeros are written as '0', or as ``na`` in columns identified by
+    boolean array ``nan_cols``.
+
+    """
+
+    mat = sparse.csr_matrix(mat)
+    empty_row = np.full(mat.shape[1], '0', dtype=object)
+    if nan_cols is not None:
+        empty_row[nan_cols] = na
+
+    values, inverse = np.unique(mat.data, return_inverse=True)
+    cells = np.array([r_format(v, DOUBLE, na) for v in values.tolist()],
+                     dtype=object)[inverse.ravel()]
+    row_labels = [format_levels(col, na)[col.codes] for col in labels]
+
+    with open(fname, 'w') as f:
+        f.write(','.join(r_format(name, CHARACTER) for name in header) + '\n')
+        for i in range(mat.shape[0]):
+            start, end = mat.indptr[i], mat.indptr[i + 1]
+            row = empty_row.copy()
+            row[mat.indices[start:end]] = cells[start:end]
+            f.write(','.join([col[i] for col in row_labels] + row.tolist()) + '\n')
+
+
+def get_args(arguments):
+    parser = argparse.ArgumentParser(description=__doc__)
+
+    # inputs
+    parser.add_argument('-c', '--classif')
+    parser.add_argument('-s', '--specimens')
+    parser.add_argument('-w', '--weights')
+    parser.add_argument('--remove-taxa', help='csv file with column tax_name')
+
+    # outputs
+    parser.add_argument('--by-sv')          # 0
+    parser.add_argument('--by-sv-long')     # 1
+    parser.add_argument('--by-taxon')       # 2
+    parser.add_argument('--by-taxon-rel')   # 3
+    parser.add_argument('--by-taxon-long')  # 4
+    parser.add_argument('--lineages')       # 5
+    parser.add_argument('--sv-names')       # 6
+    parser.add_argument('--removed')        # 7
+
+    sparse_outputs = parser.add_argument_group(
+        'sparse outputs', ('wide tables in sparse format; for FILE.npz, '
+                           'writes FILE.features.csv and FILE.specimens.csv'))
+    sparse_outputs.add_argument('--by-sv-npz', metavar='FILE.npz')
+    sparse_outputs.add_argument('--by-taxon-npz', metavar='FILE.npz')
+    sparse_outputs.add_argument('--by-taxon-rel-npz', metavar='FILE.npz')
+
+    # other options
+    parser.add_argument(
+        '--include-unclassified', action='store_true', default=False,
+        help='include tallies of reads not represented in --classif')
+    parser.add_argument('--min-reads', type=int, default=0)
+
+    return parser.parse_args(arguments)
+
+
+
+
+def main(arguments):
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
+
+    args = get_args(arguments)
+
+    classif = read_table(args.classif)
+    specimens = read_table(args.specimens, colnames=['seqname', 'specimen'])
+    weights = read_table(args.weights, colnames=['name', 'seqname', 'read_count'])
+
+    types = {name: col.rtype for name, col in classif.items()}
+    fields = ['name', 'want_rank', 'rank', 'rank_order', 'tax_id', 'tax_name']
+    classif = {name: classif[name] for name in fields}
+
+    if args.include_unclassified:
+        names, w_names = classif['name'], weights['name']
+        classified = np.zeros(len(names.levels) + 1, dtype=bool)
+        classified[names.codes] = True
+        in_classif = recode(w_names.codes, w_names.levels, names.levels)
+        missing = w_names.codes[~classified[in_classif] | (in_classif < 0)]
+        __, first_ix = np.unique(missing, return_index=True)
+        missing = missing[np.sort(first_ix)]
+
+        # use the classifications of the first SV (sorted by name) as
+        # a template for unclassified SVs, with all values but name
+        # and want_rank taken from its first row
+        template = np.flatnonzero(names.codes == names.codes.min())
+        added = {name: np.full(len(missing) * len(template), col.codes[template[0]])
+                 for name, col in classif.items()}
+        added['want_rank'] = np.tile(classif['want_rank'].codes[template], len(missing))
+        classif = {name: col._replace(codes=np.concatenate([col.codes, added[name]]))
+                   for name, col in classif.items()}
+
+        # names of unclassified SVs are added to the levels of name
+        levels = np.union1d(names.levels, w_names.levels[missing[missing < len(w_names.levels)]])
+        classif['name'] = Column(names.rtype, levels, np.concatenate([
+            recode(names.codes, names.levels, levels),
+            np.repeat(recode(missing, w_names.levels, levels), len(template))]))
+
+    # truncate classifications to species
+    rank_order = numeric(classif['rank_order'])
+    rank = classif['rank']
+    species = np.flatnonzero(rank.codes == match(np.array(['species']), rank.levels)[0])
+    species_order = rank_order[species[0]] if len(species) else np.nan
+    keep = rank_order <= species_order
+    classif, rank_order = subset(classif, keep), rank_order[keep]
+    name, want_rank, rank, __, tax_id, tax_name = (classif[k] for k in fields)
+
+    # ranks in order, root first
+    by_order = rank.codes[np.argsort(rank_order, kind='stable')]
+    __, first_ix = np.unique(by_order, return_index=True)
+    ranks = by_order[np.sort(first_ix)]
+
+    # some tax_names are not unique and must be distinguished by rank.
+    pairs, pair_ix, __ = distinct(tax_name.codes, rank.codes)
+    taxtab = np.bincount(pairs[:, 0], minlength=len(tax_name.levels) + 1)
+    taxtab[len(tax_name.levels)] = 0
+    if (taxtab > 1).any():
+        named = pairs[pairs[:, 0] < len(tax_name.levels)]
+        labels = [level(tax_name, t) if taxtab[t] == 1 else
+                  '{} ({})'.format(level(tax_name, t), level(rank, r))
+                  for t, r in named.tolist()]
+        levels, codes = np.unique(np.array(labels, dtype=str), return_inverse=True)
+        pair_codes = np.full(len(pairs), len(levels))
+        pair_codes[pairs[:, 0] < len(tax_name.levels)] = codes.ravel()
+        tax_name = classif['tax_name'] = Column(tax_name.rtype, levels, pair_codes[pair_ix])
+    ntax = len(tax_name.levels)
+
+    # lineages: name followed by a column for each rank
+    triples, __, first_ix = distinct(name.codes, rank.codes, tax_name.codes)
+    if len(distinct(triples[:, 0], triples[:, 1])[0]) < len(triples):
+        # report the first duplicated name and rank in input order
+        triples = triples[np.argsort(first_ix)]
+        __, __, first_pair = distinct(triples[:, 0], triples[:, 1])
+        dup = np.setdiff1d(np.arange(len(triples)), first_pair)[0]
+        raise RError('Each row of output must be identified by a unique '
+                     'combination of keys: {} {}'.format(
+                         level(name, triples[dup, 0]), level(rank, triples[dup, 1])))
+
+    lineage_header = ['name'] + [level(rank, r) for r in ranks]
+    lineage_names = np.unique(name.codes)
+    rank_col = np.zeros(len(rank.levels) + 1, dtype=int)
+    rank_col[ranks] = np.arange(len(ranks))
+    lineage_taxa = np.full((len(lineage_names), len(ranks)), ntax)
+    lineage_taxa[np.searchsorted(lineage_names, triples[:, 0]),
+                 rank_col[triples[:, 1]]] = triples[:, 2]
+
+    def lineage_columns(rows):
+        return ([Column(types['name'], name.levels, lineage_names[rows])] +
+                [Column(CHARACTER, tax_name.levels, lineage_taxa[rows, i])
+                 for i in range(len(ranks))])
+
+    # remove any excluded tax_names
+    exclude = np.zeros(len(lineage_names), dtype=bool)
+    if args.remove_taxa:
+        remove_taxa = read_table(args.remove_taxa)['tax_name']
+
+        # fill missing ranks with name of the parent to determine the
+        # terminal classification for each sv; names in the first
+        # column are coded as -1 - code to distinguish them from taxa
+        try:
+            root_ix = lineage_header.index('root')
+            species_ix = lineage_header.index('species')
+        except ValueError as err:
+            raise RError(str(err))
+
+        filled = np.column_stack([-1 - lineage_names, lineage_taxa])
+        for i in range(root_ix, len(lineage_header)):
+            is_na = filled[:, i] == ntax
+            filled[is_na, i] = filled[is_na, i - 1]
+
+        terminal = filled[:, species_ix]
+        exclude = np.where(
+            terminal >= 0,
+            np.isin(terminal, recode(remove_taxa.codes, remove_taxa.levels, tax_name.levels)),
+            np.isin(-1 - terminal, recode(remove_taxa.codes, remove_taxa.levels, name.levels)))
+
+    if args.removed:
+        write_csv(args.removed, lineage_header, lineage_columns(exclude), na='')
+
+    # Select the most specific classification for each SV, then join
+    # with weights and specimens, retaining the order of rows in each
+    # input.
+    max_order = np.full(len(name.levels) + 1, -np.inf)
+    np.maximum.at(max_order, name.codes, rank_order)
+    included = np.zeros(len(name.levels) + 1, dtype=bool)
+    included[lineage_names[~exclude]] = True
+    selected = np.flatnonzero(
+        (rank_order == max_order[name.codes])
+        & (recode(want_rank.codes, want_rank.levels, rank.levels) == rank.codes)
+        & included[name.codes])
+
+    read_count = weights['read_count']
+    sv_ix, w_ix = left_join(
+        name.codes[selected],
+        recode(weights['name'].codes, weights['name'].levels, name.levels),
+        len(name.levels) + 1)
+    keep = np.append(numeric(read_count), np.nan)[w_ix] >= args.min_reads
+    sv_ix, w_ix = selected[sv_ix[keep]], w_ix[keep]
+
+    seqname, specimen = weights['seqname'], specimens['specimen']
+    ix, s_ix = left_join(
+        seqname.codes[w_ix],
+        recode(specimens['seqname'].codes, specimens['seqname'].levels, seqname.levels),
+        len(seqname.levels) + 1)
+    sv_ix, w_ix = sv_ix[ix], w_ix[ix]
+
+    by_sv_header = ['specimen', 'name', 'rank', 'tax_name', 'tax_id', 'read_count']
+    by_sv = [
+        Column(specimen.rtype, specimen.levels,
+               np.append(specimen.codes, len(specimen.levels))[s_ix]),
+        Column(types['name'], name.levels, name.codes[sv_ix]),
+        Column(CHARACTER, rank.levels, rank.codes[sv_ix]),
+        Column(CHARACTER, tax_name.levels, tax_name.codes[sv_ix]),
+        Column(types['tax_id'], tax_id.levels, tax_id.codes[sv_ix]),
+        Column(read_count.rtype, read_count.levels, read_count.codes[w_ix]),
+    ]
+    SPECIMEN, SV_NAME, SV_RANK, SV_TAX_NAME, SV_TAX_ID, READ_COUNT = range(len(by_sv_header))
+
+    if len(distinct(*(col.codes for col in by_sv))[0]) != len(sv_ix):
+        raise RError('duplicated rows in by_sv')
+
+    # read counts as int or float
+    counts = read_count.levels[by_sv[READ_COUNT].codes]
+    lineage_rows = ~exclude & np.isin(lineage_names, by_sv[SV_NAME].codes)
+
+    # by_sv_wide: rows are (name, tax_name), columns are specimens
+    specimen_ids, sv_col = np.unique(by_sv[SPECIMEN].codes, return_inverse=True)
+    sv_keys, sv_row, __ = distinct(by_sv[SV_NAME].codes, by_sv[SV_TAX_NAME].codes)
+    if len(np.unique(sv_row * len(specimen_ids) + sv_col)) != len(sv_row):
+        raise RError('Each row of output must be identified by a unique combination of keys')
+    by_sv_wide = sparse.coo_matrix(
+        (counts.astype(float), (sv_row, sv_col.ravel())),
+        shape=(len(sv_keys), len(specimen_ids))).tocsr()
+
+    # by_tax_name: read counts summed by specimen, tax_name and rank
+    is_named = by_sv[SV_TAX_NAME].codes < ntax
+    tax_keys, tax_row, __ = distinct(*(by_sv[i].codes[is_named]
+                                   for i in [SPECIMEN, SV_TAX_NAME, SV_RANK]))
+    tax_counts = np.zeros(len(tax_keys), dtype=counts.dtype)
+    np.add.at(tax_counts, tax_row, counts[is_named])
+
+    # order tax names by overall abundance
+    totals = np.zeros(ntax, dtype=counts.dtype)
+    np.add.at(totals, tax_keys[:, 1], tax_counts)
+    tax_names = np.unique(tax_keys[:, 1])
+    tax_names = tax_names[np.lexsort((tax_names, -totals[tax_names]))]
+    tax_ix = np.zeros(ntax, dtype=int)
+    tax_ix[tax_names] = np.arange(len(tax_names))
+
+    # by_tax_name_wide: rows are tax_names, columns are specimens; a
+    # tax_name at more than one rank must have the same read count
+    tax_specimen_ids, tax_col = np.unique(tax_keys[:, 0], return_inverse=True)
+    is_first = np.ones(len(tax_keys), dtype=bool)
+    is_first[1:] = (tax_keys[1:, :2] != tax_keys[:-1, :2]).any(axis=1)
+    if (tax_counts != tax_counts[is_first][np.cumsum(is_first) - 1]).any():
+        raise RError('Each row of output must be identified by a unique combination of keys')
+    by_tax_name_wide = sparse.coo_matrix(
+        (tax_counts[is_first].astype(float),
+         (tax_ix[tax_keys[is_first, 1]], tax_col.ravel()[is_first])),
+        shape=(len(tax_names), len(tax_specimen_ids))).tocsr()
+
+    # relative abundance within each specimen
+    col_sums = np.asarray(by_tax_name_wide.sum(axis=0)).ravel()
+    by_tax_name_wide_rel = by_tax_name_wide.copy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        by_tax_name_wide_rel.data = (
+            by_tax_name_wide_rel.data / col_sums[by_tax_name_wide_rel.indices])
+
+    is_counted = read_count.codes < len(read_count.levels)
+    total_weight = read_count.levels[read_count.codes[is_counted]].sum()
+    by_sv_weight = counts.sum()
+    by_tax_name_weight = tax_counts.sum()
+    print('total: {}\nby_sv: {}\nby_tax_name: {}'.format(
+        total_weight, by_sv_weight, by_tax_name_weight))
+
+    if by_sv_weight != by_tax_name_weight:
+        raise RError('by_sv_weight == by_tax_name_weight is not TRUE')
+
+    if args.include_unclassified:
+        if not by_sv_weight == by_tax_name_weight == total_weight:
+            raise RError('by_sv_weight == total_weight is not TRUE')
+    elif not (by_sv_weight <= total_weight and by_tax_name_weight <= total_weight):
+        raise RError('by_sv_weight <= total_weight is not TRUE')
+
+    def specimen_header(specimen_ids):
+        return format_levels(specimen, quote=False)[specimen_ids].tolist()
+
+    sv_labels = [Column(types['name'], name.levels, sv_keys[:, 0]),
+                 Column(CHARACTER, tax_name.levels, sv_keys[:, 1])]
+    if args.by_sv:
+        write_wide(args.by_sv, ['name', 'tax_name'] + specimen_header(specimen_ids),
+                   sv_labels, by_sv_wide)
+
+    if args.by_sv_npz:
+        write_sparse(args.by_sv_npz, by_sv_wide, ['name', 'tax_name'],
+                     list(zip(*(to_list(col) for col in sv_labels))),
+                     specimen_header(specimen_ids))
+
+    if args.by_sv_long:
+        write_csv(args.by_sv_long, by_sv_header, by_sv)
+
+    tax_labels = [Column(CHARACTER, tax_name.levels, tax_names)]
+    tax_header = ['tax_name'] + specimen_header(tax_specimen_ids)
+    if args.by_taxon:
+        write_wide(args.by_taxon, tax_header, tax_labels, by_tax_name_wide)
+
+    if args.by_taxon_npz:
+        write_sparse(args.by_taxon_npz, by_tax_name_wide, ['tax_name'],
+                     list(zip(to_list(tax_labels[0]))), specimen_header(tax_specimen_ids))
+
+    if args.by_taxon_long:
+        # arrange(by_tax_name, tax_name, desc(read_count))
+        order = np.lexsort((-tax_counts, tax_keys[:, 1]))
+        count_levels, count_codes = np.unique(tax_counts[order], return_inverse=True)
+        write_csv(args.by_taxon_long, ['specimen', 'tax_name', 'rank', 'read_count'],
+                  [Column(specimen.rtype, specimen.levels, tax_keys[order, 0]),
+                   Column(CHARACTER, tax_name.levels, tax_keys[order, 1]),
+                   Column(CHARACTER, rank.levels, tax_keys[order, 2]),
+                   Column(read_count.rtype, count_levels, count_codes.ravel())])
+
+    if args.by_taxon_rel:
+        write_wide(args.by_taxon_rel, tax_header, tax_labels,
+                   by_tax_name_wide_rel, na='', nan_cols=col_sums == 0)
+
+    if args.by_taxon_rel_npz:
+        write_sparse(args.by_taxon_rel_npz, by_tax_name_wide_rel, ['tax_name'],
+                     list(zip(to_list(tax_labels[0]))), specimen_header(tax_specimen_ids))
+
+    if args.lineages:
+        write_csv(args.lineages, lineage_header, lineage_columns(lineage_rows), na='')
+
+    if args.sv_names:
+        with open(args.sv_names, 'w') as f:
+            f.writelines(format_levels(sv_labels[0], quote=False)[sv_keys[:, 0]] + '\n')
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+"""Search query sequences against reference sequences with vsearch
+and write hits as csv
+
+Replaces ``vsearch --usearch_global ... --blast6out`` followed by
+blast2csv.py: blast6 output of each vsearch process is read from a
+pipe and written directly to csv with the headers used by
+blast2csv.py, so the blast6 output is never saved.
+
+With --udb-cache, the reference database is built once using
+``vsearch --makeudb_usearch`` and saved in a file named according to
+the md5 checksum of the reference sequences, so later searches against
+the same references do not index the fasta file again.
+
+Queries may be divided into --shards contiguous chunks, each searched
+by a separate vsearch process using a share of --threads (or with
+--srun, submitted as a slurm job step). Hits are written in the order
+of the chunks.
+
+With --hit-cache, hits for each query sequence are saved in a sqlite
+database (see hitcache.py) keyed by the sequence, the checksum of the
+reference sequences, and search options, and only sequences not found
+in the cache are searched. Hits are then written in the order of the
+queries.
+
+--vsearch may include a command prefix, for example, "singularity
+exec image.sif vsearch".
+
+"""
+
+import argparse
+import csv
+import logging
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import threading
+
+from fastalite import fastalite
+
+from blast2csv import blast_headers
+from hitcache import HitCache, md5sum, seq_hash
+from shards import write_shards
+
+log = logging.getLogger(__name__)
+
+
+def get_udb(vsearch, ref_seqs, cache_dir):
+    """Return the path of a UDB database for ``ref_seqs`` in
+    ``cache_dir``, creating it if necessary.
+
+    """
+
+    base = os.path.splitext(os.path.basename(ref_seqs))[0]
+    udb = os.path.join(cache_dir, '{}-{}.udb'.format(base, md5sum(ref_seqs)))
+    if os.path.exists(udb):
+        log.info('using cached database {}'.format(udb))
+        return udb
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # concurrent jobs sharing the cache each write a separate file
+    fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.udb.tmp')
+    os.close(fd)
+    cmd = vsearch + ['--makeudb_usearch', ref_seqs, '--output', tmp]
+    log.info(' '.join(cmd))
+    try:
+        subprocess.check_call(cmd)
+    except subprocess.CalledProcessError:
+        os.remove(tmp)
+        raise
+    os.replace(tmp, udb)
+    return udb
+
+
+class Search(object):
+    """Run vsearch on ``queries``, reading blast6 output from stdout in
+    a separate thread.
+
+    """
+
+    def __init__(self, cmd, queries):
+        cmd = cmd + ['--usearch_global', queries, '--blast6out', '/dev/stdout']
+        log.info(' '.join(cmd))
+        self.rows = []
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+        self.reader = threading.Thread(target=self.read_hits, daemon=True)
+        self.reader.start()
+
+    def read_hits(self):
+        self.rows = list(csv.reader(self.proc.stdout, delimiter='\t'))
+
+    def wait(self):
+        """Wait for the search to complete and return rows of hits"""
+        self.reader.join()
+        returncode = self.proc.wait()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, self.proc.args)
+        return self.rows
+
+
+def run_searches(vsearch, options, queries, args):
+    """Search ``queries`` and return a list of rows of hits"""
+    db = get_udb(vsearch, args.ref_seqs, args.udb_cache) if args.udb_cache else args.ref_seqs
+
+    nshards = max(1, args.shards)
+    threads = max(1, args.threads // nshards)
+    cmd = vsearch + ['--db', db] + options + ['--threads', str(threads)]
+    if args.srun:
+        cmd = ['srun', '--ntasks', '1', '--cpus-per-task', str(threads)] + cmd
+
+    rows = []
+    with tempfile.TemporaryDirectory(dir='.') as tmpdir:
+        shards = [queries] if nshards == 1 else write_shards(queries, nshards, tmpdir)
+        searches = [Search(cmd, fname) for fname in shards]
+        for search in searches:
+            try:
+                rows.extend(search.wait())
+            except subprocess.CalledProcessError:
+                for other in searches:
+                    other.proc.kill()
+                raise
+    return rows
+
+
+def get_args(arguments):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('queries', help='query sequences (fasta)')
+    parser.add_argument('ref_seqs', help='reference sequences (fasta)')
+    parser.add_argument('-o', '--outfile', type=argparse.FileType('w'),
+                        default=sys.stdout, help='csv file of hits')
+    parser.add_argument('--udb-cache', metavar='DIR',
+                        help='directory for reference databases in UDB format')
+    parser.add_argument('--hit-cache', metavar='FILE',
+                        help='sqlite database of hits for previously searched sequences')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='total number of threads [%(default)s]')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='number of concurrent vsearch processes [%(default)s]')
+    parser.add_argument('--srun', action='store_true', default=False,
+                        help='run each vsearch process using srun')
+    parser.add_argument('--vsearch', default='vsearch',
+                        help='vsearch command [%(default)s]')
+
+    search = parser.add_argument_group('search options')
+    search.add_argument('--id', default='0.8', help='[%(default)s]')
+    search.add_argument('--query-cov', default='0.9', help='[%(default)s]')
+    search.add_argument('--maxaccepts', default='1', help='[%(default)s]')
+    search.add_argument('--strand', default='plus', help='[%(default)s]')
+    return parser.parse_args(arguments)
+
+
+def main(arguments):
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
+
+    args = get_args(arguments)
+
+    vsearch = shlex.split(args.vsearch)
+    options = ['--strand', args.strand,
+               '--id', args.id,
+               '--query_cov', args.query_cov,
+               '--maxaccepts', args.maxaccepts]
+
+    with tempfile.TemporaryDirectory(dir='.') as tmpdir:
+        queries = args.queries
+        if args.hit_cache:
+            cache = HitCache(args.hit_cache, 'vsearch', md5sum(args.ref_seqs), ' '.join(options))
+            with open(args.queries) as f:
+                seqs = [(seq.id, seq_hash(seq.seq), seq.seq) for seq in fastalite(f)]
+            cached = cache.get({seqhash for __, seqhash, __ in seqs})
+            novel = [(name, seq) for name, seqhash, seq in seqs if seqhash not in cached]
+            log.info('{} of {} queries found in {}'.format(
+                len(seqs) - len(novel), len(seqs), args.hit_cache))
+
+            queries = os.path.join(tmpdir, 'novel.fasta')
+            with open(queries, 'w') as f:
+                f.writelines('>{}\n{}\n'.format(name, seq) for name, seq in novel)
+
+        rows = run_searches(vsearch, options, queries, args) if os.path.getsize(queries) else []
+
+    writer = csv.writer(args.outfile)
+    writer.writerow(blast_headers)
+    if args.hit_cache:
+        # hits are cached without the query name; identical sequences
+        # with different names are saved once
+        new_hits = {seqhash: [] for name, seqhash, __ in seqs if seqhash not in cached}
+        hashes = dict((name, seqhash) for name, seqhash, __ in seqs)
+        first = {}
+        for name, seqhash, __ in seqs:
+            first.setdefault(seqhash, name)
+        for row in rows:
+            if first[hashes[row[0]]] == row[0]:
+                new_hits[hashes[row[0]]].append(row[1:])
+        cache.put(new_hits)
+        cache.close()
+        cached.update(new_hits)
+
+        rows = [[name] + row for name, seqhash, __ in seqs for row in cached[seqhash]]
+
+    writer.writerows(rows)
+    log.info('{} hits'.format(len(rows)))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))